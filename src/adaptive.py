@@ -0,0 +1,218 @@
+"""
+Deadline-aware pipeline: pick a quality tier that fits a latency budget.
+
+Steps 1-2 (plus block moves) always run because every tier builds on their
+anchors. The time they took is subtracted from the budget and the remaining
+tiers are tried from best to cheapest until one's estimated cost fits:
+
+- full: Steps 3-5 as in run_pipeline.
+- reduced: Steps 3-4 with a smaller k and no Step 5.
+- simhash: Step 3 only, scoring candidates by SimHash distance alone.
+- anchors: Step 2 anchors only; every other old line is marked -1.
+"""
+import argparse
+import heapq
+import time
+
+from preprocess import preprocess_file_bulk
+from main import detect_anchors, match_unmatched
+from candidate_match import assign_greedy
+from utils import simhash, hamming_distance, merge_mappings
+
+TIERS = ("full", "reduced", "simhash", "anchors")
+
+# Rough per-operation costs in seconds, measured on the provided dataset with
+# CPython 3.11. They only need to rank tiers against the time that is left.
+FINGERPRINT_COST = 4e-5
+HAMMING_PAIR_COST = 3e-6
+SCORE_CHAR_COST = 4e-7
+SPLIT_SCORES_PER_LINE = 3
+# Estimates run a little low on pairs with long lines; keep some headroom.
+SAFETY_FACTOR = 1.3
+
+REDUCED_K = 5
+SIMHASH_K = 3
+SIMHASH_MIN_SCORE = 0.65
+
+
+def mean_square_length(unmatched_old, unmatched_new):
+    """Mean squared normalized line length, which is what Levenshtein cost tracks."""
+    count = len(unmatched_old) + len(unmatched_new)
+    if count == 0:
+        return 0.0
+    total = 0
+    for record in unmatched_old:
+        total += len(record["norm"]) ** 2
+    for record in unmatched_new:
+        total += len(record["norm"]) ** 2
+    return total / count
+
+
+def estimate_seconds(tier, n_old, n_new, square_len, k=15):
+    """Estimate how long a tier's Steps 3-5 take for pools of this size."""
+    if tier == "anchors" or n_old == 0 or n_new == 0:
+        return 0.0
+
+    step3 = FINGERPRINT_COST * (n_old + n_new) + HAMMING_PAIR_COST * n_old * n_new
+    if tier == "simhash":
+        return SAFETY_FACTOR * step3
+
+    # combined_similarity is dominated by the quadratic Levenshtein table.
+    per_score = SCORE_CHAR_COST * square_len
+    if tier == "reduced":
+        return SAFETY_FACTOR * (step3 + n_old * min(REDUCED_K, n_new) * per_score)
+
+    step45 = n_old * min(k, n_new) * per_score + n_old * SPLIT_SCORES_PER_LINE * per_score
+    return SAFETY_FACTOR * (step3 + step45)
+
+
+def choose_tier(n_old, n_new, square_len, remaining, k=15):
+    """Return the best tier whose estimated cost fits in the remaining seconds."""
+    for tier in TIERS:
+        if estimate_seconds(tier, n_old, n_new, square_len, k=k) <= remaining:
+            return tier
+    return "anchors"
+
+
+def simhash_matches(unmatched_old, unmatched_new, k=SIMHASH_K, min_score=SIMHASH_MIN_SCORE):
+    """
+    Match lines by SimHash alone: score = 1 - hamming / 64 over each old
+    line's k nearest fingerprints, then the usual greedy assignment.
+    """
+    new_fps = [(record["line_no"], simhash(record["norm"])) for record in unmatched_new]
+
+    scored_pairs = []
+    for record in unmatched_old:
+        old_fp = simhash(record["norm"])
+        nearest = heapq.nsmallest(
+            k, ((hamming_distance(old_fp, new_fp), new_ln) for new_ln, new_fp in new_fps),
+            key=lambda pair: pair[0]
+        )
+        for dist, new_ln in nearest:
+            score = 1.0 - dist / 64.0
+            if score >= min_score:
+                scored_pairs.append((score, record["line_no"], new_ln))
+
+    match_map, match_scores = assign_greedy(scored_pairs, unmatched_old)
+    return match_map
+
+
+def run_tier(tier, unmatched_old, unmatched_new, k=15, threshold=0.5, threshold_gain=0.02, max_extra=4,
+             memory_budget=None, workers=1, anchor_map=None):
+    """
+    Run one tier's Steps 3-5 on the unmatched pools. memory_budget, workers
+    and anchor_map apply to the full and reduced tiers as in match_unmatched.
+    """
+    if tier == "full":
+        return match_unmatched(unmatched_old, unmatched_new, k=k, threshold=threshold,
+                               threshold_gain=threshold_gain, max_extra=max_extra,
+                               memory_budget=memory_budget, workers=workers, anchor_map=anchor_map)
+    if tier == "reduced":
+        return match_unmatched(unmatched_old, unmatched_new, k=REDUCED_K, threshold=threshold, splits=False,
+                               memory_budget=memory_budget, workers=workers, anchor_map=anchor_map)
+    if tier == "simhash":
+        return simhash_matches(unmatched_old, unmatched_new), {}
+    if tier == "anchors":
+        return {record["line_no"]: -1 for record in unmatched_old}, {}
+    raise ValueError("unknown tier: " + str(tier))
+
+
+def run_adaptive_pipeline(old_path, new_path, latency_budget, tier=None, skip_comments=False,
+                          memory_budget=None, workers=1, anchored=False):
+    """
+    Run the pipeline within latency_budget seconds (best effort) and return
+    (merged_map, split_map, tier). Passing tier forces that tier.
+    memory_budget, workers and anchored are passed to the full and reduced
+    tiers like run_pipeline does.
+    """
+    started = time.perf_counter()
+
+    old_records = preprocess_file_bulk(old_path, skip_comments=skip_comments)
+    new_records = preprocess_file_bulk(new_path, skip_comments=skip_comments)
+    anchor_map, unmatched_old, unmatched_new = detect_anchors(old_records, new_records)
+
+    if tier is None:
+        remaining = latency_budget - (time.perf_counter() - started)
+        square_len = mean_square_length(unmatched_old, unmatched_new)
+        tier = choose_tier(len(unmatched_old), len(unmatched_new), square_len, remaining)
+
+    final_map, split_map = run_tier(
+        tier, unmatched_old, unmatched_new, memory_budget=memory_budget, workers=workers,
+        anchor_map=anchor_map if anchored else None
+    )
+
+    merged_map = merge_mappings(anchor_map, final_map)
+
+    return merged_map, split_map, tier
+
+
+def benchmark(pairs, latency_budget):
+    """
+    Run every pair once per forced tier and once adaptively, returning rows of
+    accuracy and timing so the cost of each tier is visible.
+    """
+    from metrics import score_mapping, accuracy_percent
+
+    rows = []
+    for mode in TIERS + ("adaptive",):
+        correct = 0
+        total = 0
+        seconds = []
+        chosen = {}
+        for pair in pairs:
+            forced = None if mode == "adaptive" else mode
+            started = time.perf_counter()
+            mapping, split_map, tier = run_adaptive_pipeline(
+                pair["old_path"], pair["new_path"], latency_budget, tier=forced
+            )
+            seconds.append(time.perf_counter() - started)
+            chosen[tier] = chosen.get(tier, 0) + 1
+
+            pair_correct, pair_total = score_mapping(mapping, pair["truth"])
+            correct += pair_correct
+            total += pair_total
+
+        over = sum(1 for value in seconds if value > latency_budget)
+        rows.append({
+            "mode": mode,
+            "correct": correct,
+            "total": total,
+            "accuracy": accuracy_percent(correct, total),
+            "total_s": sum(seconds),
+            "max_s": max(seconds) if seconds else 0.0,
+            "over_budget": over,
+            "tiers": chosen
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark accuracy and latency of each quality tier.")
+    parser.add_argument("--dataset", choices=["provided", "my_dataset"], required=True)
+    parser.add_argument("--latency-budget", type=float, default=0.2, help="seconds per pair for adaptive mode")
+    args = parser.parse_args()
+
+    if args.dataset == "provided":
+        from provided_loader import load_provided_pairs
+        pairs = load_provided_pairs()
+    else:
+        from my_dataset_loader import load_my_dataset_pairs
+        pairs = load_my_dataset_pairs()
+
+    print("Pairs:", len(pairs), " budget:", args.latency_budget, "s")
+    print("mode        correct/total  accuracy   total_s    max_s  over_budget  tiers")
+    for row in benchmark(pairs, args.latency_budget):
+        tiers = ", ".join(name + "=" + str(row["tiers"][name]) for name in TIERS if name in row["tiers"])
+        print(
+            row["mode"].ljust(10),
+            (str(row["correct"]) + "/" + str(row["total"])).rjust(14),
+            (format(row["accuracy"], ".2f") + "%").rjust(9),
+            format(row["total_s"], ".3f").rjust(9),
+            format(row["max_s"], ".3f").rjust(8),
+            str(row["over_budget"]).rjust(12),
+            " " + tiers
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+"""
+Manifest-driven batch runner: map many arbitrary old/new pairs in one process.
+
+The manifest is JSONL (one {"old": ..., "new": ...} object per line) or CSV
+with an old,new header; "name" and "out" are optional. Results stream to
+stdout as one JSON line per pair as soon as that pair finishes. Pipeline
+modules are imported on first use so the process starts quickly.
+"""
+import sys
+import os
+import json
+import time
+from collections import OrderedDict
+
+_pipeline = None
+_records_cache = OrderedDict()
+
+
+def load_pipeline():
+    """Import the pipeline the first time a pair needs it."""
+    global _pipeline
+    if _pipeline is None:
+        from preprocess import preprocess_file_bulk
+        from main import match_records
+        from utils import save_prediction_xml
+        _pipeline = {
+            "preprocess": preprocess_file_bulk,
+            "match": match_records,
+            "save": save_prediction_xml
+        }
+    return _pipeline
+
+
+def cached_records(path, skip_comments, cache_size):
+    """
+    Preprocess a file once per batch. Entries are keyed by path, size and
+    mtime so an edited file is read again, and the oldest are evicted first.
+    """
+    info = os.stat(path)
+    key = (os.path.abspath(path), info.st_size, info.st_mtime_ns, skip_comments)
+    if key in _records_cache:
+        _records_cache.move_to_end(key)
+        return _records_cache[key]
+
+    records = load_pipeline()["preprocess"](path, skip_comments=skip_comments)
+    if cache_size > 0:
+        _records_cache[key] = records
+        while len(_records_cache) > cache_size:
+            _records_cache.popitem(last=False)
+    return records
+
+
+def default_name(old_path, new_path):
+    """Name a pair after both file stems, or just one when they are the same."""
+    old_stem = os.path.splitext(os.path.basename(old_path))[0]
+    new_stem = os.path.splitext(os.path.basename(new_path))[0]
+    if old_stem == new_stem:
+        return old_stem
+    return old_stem + "__" + new_stem
+
+
+def parse_row(row):
+    """Turn one manifest row into an entry dict with old, new, name and out keys."""
+    if not isinstance(row, dict):
+        raise ValueError("manifest entry must be an object")
+    old_path = row.get("old") or row.get("old_path")
+    new_path = row.get("new") or row.get("new_path")
+    if not old_path or not new_path:
+        raise ValueError("manifest entry needs old and new paths: " + json.dumps(row))
+    if not isinstance(old_path, str) or not isinstance(new_path, str):
+        raise ValueError("manifest paths must be strings: " + json.dumps(row))
+    name = row.get("name") or default_name(old_path, new_path)
+    if not isinstance(name, str):
+        raise ValueError("manifest name must be a string: " + json.dumps(row))
+    return {"name": name, "old": old_path, "new": new_path, "out": row.get("out") or None}
+
+
+def read_manifest(handle, fmt=None):
+    """
+    Yield (line number, entry) for each manifest row. The format is guessed
+    from the first non-blank character when not given. A row that cannot be
+    parsed yields {"error": ...} instead of an entry so the batch carries on.
+    """
+    first = ""
+    first_number = 0
+    lines = iter(handle)
+    for line in lines:
+        first_number += 1
+        if line.strip():
+            first = line
+            break
+    if not first:
+        return
+
+    if fmt is None:
+        fmt = "jsonl" if first.lstrip().startswith("{") else "csv"
+
+    def rest():
+        yield first
+        for line in lines:
+            yield line
+
+    if fmt == "jsonl":
+        for offset, line in enumerate(rest()):
+            if not line.strip():
+                continue
+            try:
+                entry = parse_row(json.loads(line))
+            except ValueError as error:
+                entry = {"error": str(error)}
+            yield first_number + offset, entry
+        return
+
+    import csv
+    reader = csv.reader(rest())
+    try:
+        header = next(reader)
+    except csv.Error as error:
+        yield first_number, {"error": str(error)}
+        return
+    while True:
+        try:
+            values = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as error:
+            yield first_number - 1 + reader.line_num, {"error": str(error)}
+            continue
+        if not values:
+            continue
+        try:
+            entry = parse_row(dict(zip(header, values)))
+        except ValueError as error:
+            entry = {"error": str(error)}
+        yield first_number - 1 + reader.line_num, entry
+
+
+def output_path(entry, args):
+    """Return where the entry's XML goes, or None to inline the mapping."""
+    if entry["out"] is not None:
+        return entry["out"]
+    if args.out_dir:
+        return os.path.join(args.out_dir, entry["name"] + ".xml")
+    return None
+
+
+def run_entry(entry, args):
+    """Map one manifest entry and return the JSON-ready result."""
+    pipeline = load_pipeline()
+    started = time.perf_counter()
+    old_records = cached_records(entry["old"], args.skip_comments, args.cache_size)
+    new_records = cached_records(entry["new"], args.skip_comments, args.cache_size)
+    mapping, split_map = pipeline["match"](old_records, new_records, memory_budget=args.memory_budget)
+    seconds = time.perf_counter() - started
+
+    result = {"name": entry["name"], "old": entry["old"], "new": entry["new"]}
+
+    out_path = output_path(entry, args)
+    if out_path is not None:
+        pipeline["save"](entry["name"], mapping, split_map, out_path)
+        result["out"] = out_path
+    else:
+        result["mapping"] = [[old_ln, mapping[old_ln]] for old_ln in sorted(mapping)]
+        result["splits"] = [[old_ln, split_map[old_ln]] for old_ln in sorted(split_map)]
+
+    result["seconds"] = round(seconds, 6)
+    return result
+
+
+def main():
+    import argparse
+    from utils import parse_size
+
+    parser = argparse.ArgumentParser(description="Map every old/new pair listed in a manifest.")
+    parser.add_argument("manifest", help="manifest path, or - for stdin")
+    parser.add_argument("--format", choices=["jsonl", "csv"], help="manifest format (guessed if omitted)")
+    parser.add_argument("--out-dir", help="write <name>.xml here instead of inlining mappings in the output")
+    parser.add_argument("--skip-comments", action="store_true",
+                        help="leave Java comment-only lines out of the mapping like blank lines")
+    parser.add_argument("--memory-budget", type=parse_size,
+                        help="bound Step 3-4 candidate and scored-pair memory, e.g. 64M; old lines run in chunks "
+                             "and scored pairs spill to a temp file")
+    parser.add_argument("--cache-size", type=int, default=256,
+                        help="preprocessed files kept in memory for reuse across pairs")
+    args = parser.parse_args()
+
+    if args.manifest == "-":
+        handle = sys.stdin
+    else:
+        handle = open(args.manifest, "r", encoding="utf8", newline="")
+
+    failures = 0
+    written = set()
+    try:
+        for line_number, entry in read_manifest(handle, args.format):
+            out_path = None if "error" in entry else output_path(entry, args)
+            if out_path is not None:
+                out_key = os.path.abspath(out_path)
+                if out_key in written:
+                    entry = {"error": "output " + out_path + " is already written by an earlier row; set name or out"}
+                written.add(out_key)
+            if "error" in entry:
+                failures += 1
+                result = {"line": line_number, "error": entry["error"]}
+            else:
+                try:
+                    result = run_entry(entry, args)
+                except Exception as error:
+                    failures += 1
+                    result = {"name": entry["name"], "old": entry["old"], "new": entry["new"], "error": str(error)}
+            sys.stdout.write(json.dumps(result) + "\n")
+            sys.stdout.flush()
+    finally:
+        if handle is not sys.stdin:
+            handle.close()
+
+    if failures:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+import sys
+
+from preprocess import preprocess_file
+from unchanged_detect import detect_unchanged
+from utils import tokenize
+
+_HASH_BASE = 1000003
+_HASH_MOD = (1 << 61) - 1
+
+
+def intern_norms(unmatched_old, unmatched_new):
+    """Give every distinct normalized line a small integer id shared by both pools."""
+    ids = {}
+    old_ids = []
+    for record in unmatched_old:
+        old_ids.append(ids.setdefault(record["norm"], len(ids)))
+    new_ids = []
+    for record in unmatched_new:
+        new_ids.append(ids.setdefault(record["norm"], len(ids)))
+    return old_ids, new_ids
+
+
+def rolling_hashes(ids, window):
+    """
+    Return the polynomial hash of every run of `window` consecutive ids,
+    updating the previous window's hash in O(1) instead of rehashing it.
+    """
+    if window <= 0 or len(ids) < window:
+        return []
+
+    top = pow(_HASH_BASE, window - 1, _HASH_MOD)
+    value = 0
+    for line_id in ids[:window]:
+        value = (value * _HASH_BASE + line_id + 1) % _HASH_MOD
+
+    hashes = [value]
+    for start in range(1, len(ids) - window + 1):
+        value = (value - (ids[start - 1] + 1) * top) % _HASH_MOD
+        value = (value * _HASH_BASE + ids[start + window - 1] + 1) % _HASH_MOD
+        hashes.append(value)
+    return hashes
+
+
+def _has_content(records):
+    """True if the block holds at least one word token, so brace-only runs are ignored."""
+    for record in records:
+        if tokenize(record["norm"]):
+            return True
+    return False
+
+
+def detect_block_moves(unmatched_old, unmatched_new, min_lines=3, ids=None):
+    """
+    Map runs of at least `min_lines` identical normalized lines that appear
+    anywhere in the unmatched pools, which catches moved methods that difflib
+    skipped because they broke the relative order. Returns the block mapping
+    plus the old/new pools with the mapped records removed. ids, a pair of
+    (old_ids, new_ids) lists aligned with the pools that are equal exactly
+    when the lines are, replaces intern_norms.
+    """
+    if ids is None:
+        ids = intern_norms(unmatched_old, unmatched_new)
+    old_ids, new_ids = ids
+
+    new_windows = {}
+    for start, value in enumerate(rolling_hashes(new_ids, min_lines)):
+        if value not in new_windows:
+            new_windows[value] = []
+        new_windows[value].append(start)
+
+    old_hashes = rolling_hashes(old_ids, min_lines)
+    used_new = [False] * len(new_ids)
+    block_map = {}
+
+    i = 0
+    while i < len(old_hashes):
+        best_start = -1
+        best_length = 0
+
+        for j in new_windows.get(old_hashes[i], []):
+            length = 0
+            while (i + length < len(old_ids) and j + length < len(new_ids)
+                   and not used_new[j + length]
+                   and old_ids[i + length] == new_ids[j + length]):
+                length += 1
+            if length > best_length:
+                best_start = j
+                best_length = length
+
+        if best_length < min_lines or not _has_content(unmatched_old[i:i + best_length]):
+            i += 1
+            continue
+
+        for offset in range(best_length):
+            old_ln = unmatched_old[i + offset]["line_no"]
+            block_map[old_ln] = unmatched_new[best_start + offset]["line_no"]
+            used_new[best_start + offset] = True
+        i += best_length
+
+    remaining_old = []
+    for record in unmatched_old:
+        if record["line_no"] not in block_map:
+            remaining_old.append(record)
+
+    remaining_new = []
+    for index, record in enumerate(unmatched_new):
+        if not used_new[index]:
+            remaining_new.append(record)
+
+    return block_map, remaining_old, remaining_new
+
+
+def print_some_blocks(block_map, limit=15):
+    """Print a subset of block-moved lines for manual inspection."""
+    shown = 0
+    for old_ln in sorted(block_map.keys()):
+        print(str(old_ln) + " -> " + str(block_map[old_ln]))
+        shown += 1
+        if shown >= limit:
+            break
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage:")
+        print("  python block_move_detect.py <old_file> <new_file>")
+        raise SystemExit(1)
+
+    old_path = sys.argv[1]
+    new_path = sys.argv[2]
+
+    old_records = preprocess_file(old_path)
+    new_records = preprocess_file(new_path)
+
+    unchanged_map, unmatched_old, unmatched_new = detect_unchanged(old_records, new_records)
+
+    print("Unchanged matches:", len(unchanged_map))
+    print("Unmatched old:", len(unmatched_old))
+    print("Unmatched new:", len(unmatched_new))
+
+    block_map, unmatched_old, unmatched_new = detect_block_moves(unmatched_old, unmatched_new, min_lines=3)
+
+    print("\nBlock-moved lines:", len(block_map))
+    print("Remaining unmatched old:", len(unmatched_old))
+    print("Remaining unmatched new:", len(unmatched_new))
+
+    if len(block_map) > 0:
+        print("\nSample block moves (old -> new):")
+        print_some_blocks(block_map, limit=15)
@@ -1,8 +1,22 @@
 import sys
+import heapq
+import tempfile
+from array import array
+from bisect import bisect_left, bisect_right
 
 from preprocess import preprocess_file
 from unchanged_detect import detect_unchanged
-from utils import simhash, hamming_distance, combined_similarity
+from utils import simhash, hamming_distance, levenshtein_similarity, levenshtein_upper_bound
+from sparse_cosine import build_token_matrix, pair_cosines
+from spill import PAIR_BYTES, write_run, merge_runs
+
+# Rough in-memory cost of one candidate under a memory budget: its list slot
+# plus its share of the chunk's texts and token matrices.
+CANDIDATE_BYTES = 400
+
+# Below these sizes process start-up costs more than splitting the work saves.
+PARALLEL_MIN_DISTANCES = 20000
+PARALLEL_MIN_SCORES = 500
 
 
 def make_record_dict(records):
@@ -13,24 +27,84 @@ def make_record_dict(records):
     return d
 
 
-def get_candidate_sets(unmatched_old, unmatched_new, k=15):
+def fingerprint_index(records, sort_by_line=False):
+    """Pack line numbers and SimHash fingerprints of a pool into two compact arrays."""
+    pairs = [(record["line_no"], simhash(record["norm"])) for record in records]
+    if sort_by_line:
+        pairs.sort()
+    return {
+        "line_nos": array("q", [line_no for line_no, _ in pairs]),
+        "fps": array("Q", [fp for _, fp in pairs])
+    }
+
+
+def build_old_index(records):
+    """
+    Precompute the old side's Step 3-4 features once so they can be reused
+    against many new files: SimHash fingerprints by line number, and the
+    token-count matrix, row lookup, texts and vocabulary build_scorer needs.
+    The texts end with "" for old lines outside the index, as in build_scorer.
+    """
+    rows = {}
+    for row, record in enumerate(records):
+        rows[record["line_no"]] = row
+    texts = [record["norm"] for record in records] + [""]
+
+    vocab = {}
+    return {
+        "fps": {record["line_no"]: simhash(record["norm"]) for record in records},
+        "rows": rows,
+        "texts": texts,
+        "matrix": build_token_matrix(texts, vocab),
+        "vocab": vocab
+    }
+
+
+def old_fingerprint(record, old_index=None):
+    """SimHash of an old record, read from old_index when one is given."""
+    if old_index is not None:
+        return old_index["fps"][record["line_no"]]
+    return simhash(record["norm"])
+
+
+def get_candidate_sets(unmatched_old, unmatched_new, k=15, heap=False, workers=1, new_index=None,
+                       old_index=None):
     """
     Build top-k candidate lists for each unmatched old line using SimHash
-    fingerprints and Hamming distance comparisons.
+    fingerprints and Hamming distance comparisons. heap=True picks the top k
+    with a bounded heap instead of sorting a full distance list per old line;
+    the chosen candidates are the same. workers > 1 splits the old lines
+    across processes (ignored with heap=True). new_index, from
+    fingerprint_index(unmatched_new), can be passed to reuse it across calls,
+    and old_index, from build_old_index, supplies the old fingerprints.
     """
+    if (old_index is None and workers > 1 and not heap
+            and len(unmatched_old) * len(unmatched_new) >= PARALLEL_MIN_DISTANCES):
+        from parallel_match import parallel_candidate_sets
+        return parallel_candidate_sets(unmatched_old, unmatched_new, k, workers)
+
     old_fps = []
     for record in unmatched_old:
-        old_fps.append((record["line_no"], simhash(record["norm"])))
+        old_fps.append((record["line_no"], old_fingerprint(record, old_index)))
 
-    new_fps = []
-    for record in unmatched_new:
-        new_fps.append((record["line_no"], simhash(record["norm"])))
+    if new_index is None:
+        new_index = fingerprint_index(unmatched_new)
 
     candidates = {}
 
     for old_ln, old_fp in old_fps:
+        if heap:
+            # nsmallest is stable like sort, so ties keep new line order.
+            distances = heapq.nsmallest(
+                k, ((hamming_distance(old_fp, new_fp), new_ln)
+                    for new_ln, new_fp in zip(new_index["line_nos"], new_index["fps"])),
+                key=lambda pair: pair[0]
+            )
+            candidates[old_ln] = [new_ln for _, new_ln in distances]
+            continue
+
         distances = []
-        for new_ln, new_fp in new_fps:
+        for new_ln, new_fp in zip(new_index["line_nos"], new_index["fps"]):
             dist = hamming_distance(old_fp, new_fp)
             distances.append((dist, new_ln))
 
@@ -44,29 +118,204 @@ def get_candidate_sets(unmatched_old, unmatched_new, k=15):
     return candidates
 
 
-def resolve_best_matches(unmatched_old, unmatched_new, candidates, threshold=0.5):
+def monotone_anchors(anchor_map):
     """
-    Score each candidate pair using combined similarity and greedily assign
-    best matches so each new line is used at most once. Anything below the
-    threshold is marked deleted (-1).
+    Return the longest run of anchors whose new lines increase with their old
+    lines, as (old_ln, new_ln) pairs. Block moves can break the ordering that
+    difflib anchors keep, and gap windows only make sense on a monotone chain.
     """
-    old_dict = make_record_dict(unmatched_old)
-    new_dict = make_record_dict(unmatched_new)
+    anchors = sorted(anchor_map.items())
+    tails = []
+    tail_index = []
+    parents = [-1] * len(anchors)
+
+    for index, (_, new_ln) in enumerate(anchors):
+        slot = bisect_left(tails, new_ln)
+        if slot > 0:
+            parents[index] = tail_index[slot - 1]
+        if slot == len(tails):
+            tails.append(new_ln)
+            tail_index.append(index)
+        else:
+            tails[slot] = new_ln
+            tail_index[slot] = index
+
+    chain = []
+    index = tail_index[-1] if tail_index else -1
+    while index != -1:
+        chain.append(anchors[index])
+        index = parents[index]
+    chain.reverse()
+    return chain
+
+
+def anchored_index(unmatched_new, anchor_map):
+    """Line-sorted fingerprints of the new pool plus the monotone anchor chain."""
+    index = fingerprint_index(unmatched_new, sort_by_line=True)
+    anchors = monotone_anchors(anchor_map)
+    index["anchor_old"] = array("q", [old_ln for old_ln, _ in anchors])
+    index["anchor_new"] = array("q", [new_ln for _, new_ln in anchors])
+    return index
+
+
+def get_anchored_candidate_sets(unmatched_old, unmatched_new, anchor_map, k=15, max_distance=16, index=None,
+                                old_index=None):
+    """
+    Step 3 restricted to the gaps between Step 2 anchors. An old line between
+    anchors a and b first searches the new lines between the images of a and
+    b. If no candidate there is within max_distance bits, the window grows by
+    twice as many anchors on each side, up to the whole file, so moved lines
+    still find their global candidates. Only the newly covered new lines are
+    compared when a window grows, so cost follows gap sizes, not file size.
+    index, from anchored_index(unmatched_new, anchor_map), can be passed to
+    reuse it across calls; old_index supplies the old fingerprints.
+    """
+    if index is None:
+        index = anchored_index(unmatched_new, anchor_map)
+    anchor_old = index["anchor_old"]
+    anchor_new = index["anchor_new"]
+    new_line_nos = index["line_nos"]
+    new_fps = index["fps"]
+
+    candidates = {}
+
+    for record in unmatched_old:
+        old_ln = record["line_no"]
+        old_fp = old_fingerprint(record, old_index)
+        position = bisect_left(anchor_old, old_ln)
+
+        distances = []
+        start = stop = None
+        reach = 0
+        while True:
+            lower = position - 1 - reach
+            upper = position + reach
+            low = bisect_right(new_line_nos, anchor_new[lower]) if lower >= 0 else 0
+            high = bisect_left(new_line_nos, anchor_new[upper]) if upper < len(anchor_old) else len(new_line_nos)
+            high = max(low, high)
+
+            if start is None:
+                start = stop = low
+            for j in list(range(low, start)) + list(range(max(stop, low), high)):
+                distances.append((hamming_distance(old_fp, new_fps[j]), j))
+            start = min(start, low)
+            stop = max(stop, high)
+
+            # Ties go to the earlier new line, matching the global search order.
+            best = min(distances) if distances else None
+            if (lower < 0 and upper >= len(anchor_old)) or (best is not None and best[0] <= max_distance):
+                break
+            reach = reach * 2 + 1
+
+        nearest = heapq.nsmallest(k, distances)
+        candidates[old_ln] = [new_line_nos[j] for _, j in nearest]
+
+    return candidates
+
+
+def build_scorer(unmatched_old, unmatched_new, old_index=None):
+    """
+    Tokenize both pools once into sparse token-count matrices for score_pairs.
+    Old lines missing from the pool score as empty text. With old_index the
+    old side is taken from it and only the new pool is tokenized.
+    """
+    if old_index is not None:
+        vocab = dict(old_index["vocab"])
+        new_rows = {}
+        for row, record in enumerate(unmatched_new):
+            new_rows[record["line_no"]] = row
+        new_texts = [record["norm"] for record in unmatched_new]
+        new_matrix = build_token_matrix(new_texts, vocab)
+        return {
+            "old_rows": old_index["rows"],
+            "new_rows": new_rows,
+            "old_texts": old_index["texts"],
+            "new_texts": new_texts,
+            "old_matrix": old_index["matrix"],
+            "new_matrix": new_matrix,
+            "columns": len(vocab)
+        }
+
+    old_rows = {}
+    for row, record in enumerate(unmatched_old):
+        old_rows[record["line_no"]] = row
+    new_rows = {}
+    for row, record in enumerate(unmatched_new):
+        new_rows[record["line_no"]] = row
+
+    old_texts = [record["norm"] for record in unmatched_old] + [""]
+    new_texts = [record["norm"] for record in unmatched_new]
+
+    vocab = {}
+    return {
+        "old_rows": old_rows,
+        "new_rows": new_rows,
+        "old_texts": old_texts,
+        "new_texts": new_texts,
+        "old_matrix": build_token_matrix(old_texts, vocab),
+        "new_matrix": build_token_matrix(new_texts, vocab),
+        "columns": len(vocab)
+    }
+
+
+def score_pairs(scorer, pairs, threshold=0.5):
+    """
+    Score (old_ln, new_ln) pairs with combined similarity and return the
+    (score, old_ln, new_ln) triples that reach the threshold, in pair order.
+    Cosines for all pairs come from one batched sparse product, and the
+    Levenshtein table is only filled in for pairs whose length-difference
+    bound plus cosine term can still reach the threshold. Scores are the same
+    as combined_similarity.
+    """
+    missing_row = len(scorer["old_texts"]) - 1
+    old_rows = [scorer["old_rows"].get(old_ln, missing_row) for old_ln, _ in pairs]
+    new_rows = [scorer["new_rows"][new_ln] for _, new_ln in pairs]
+    cosines = pair_cosines(scorer["old_matrix"], scorer["new_matrix"], old_rows, new_rows, scorer["columns"])
 
+    old_texts = scorer["old_texts"]
+    new_texts = scorer["new_texts"]
     scored_pairs = []
 
+    for (old_ln, new_ln), old_row, new_row, cosine in zip(pairs, old_rows, new_rows, cosines):
+        old_text = old_texts[old_row]
+        new_text = new_texts[new_row]
+        cosine_term = 0.4 * cosine
+        if 0.6 * levenshtein_upper_bound(old_text, new_text) + cosine_term < threshold:
+            continue
+        score = 0.6 * levenshtein_similarity(old_text, new_text) + cosine_term
+        if score >= threshold:
+            scored_pairs.append((score, old_ln, new_ln))
+
+    return scored_pairs
+
+
+def score_candidates(unmatched_old, unmatched_new, candidates, threshold=0.5, old_index=None):
+    """
+    Score each candidate pair using combined similarity and return the
+    (score, old_ln, new_ln) triples that reach the threshold, in candidate order.
+    """
+    scorer = build_scorer(unmatched_old, unmatched_new, old_index=old_index)
+
+    pairs = []
     for old_ln, new_list in candidates.items():
-        old_text = old_dict.get(old_ln, {}).get("norm", "")
         for new_ln in new_list:
-            if new_ln not in new_dict:
-                continue
-            new_text = new_dict[new_ln]["norm"]
-            score = combined_similarity(old_text, new_text)
-            if score >= threshold:
-                scored_pairs.append((score, old_ln, new_ln))
+            if new_ln in scorer["new_rows"]:
+                pairs.append((old_ln, new_ln))
+
+    return score_pairs(scorer, pairs, threshold=threshold)
+
 
+def assign_greedy(scored_pairs, unmatched_old):
+    """
+    Greedily assign the highest scoring pairs so each old and new line is used
+    at most once. Old lines left without a partner are marked deleted (-1).
+    """
     scored_pairs.sort(key=lambda triple: triple[0], reverse=True)
+    return assign_sorted(scored_pairs, unmatched_old)
 
+
+def assign_sorted(scored_pairs, unmatched_old):
+    """Greedy assignment over pairs already ordered from best to worst score."""
     match_map = {}
     match_scores = {}
     used_new = set()
@@ -89,6 +338,100 @@ def resolve_best_matches(unmatched_old, unmatched_new, candidates, threshold=0.5
     return match_map, match_scores
 
 
+def score_candidate_chunk(chunk_old, new_dict, candidates, threshold, old_index=None):
+    """
+    Score one chunk's candidates with a scorer built only over the chunk and
+    the new lines its candidates refer to.
+    """
+    chunk_new = []
+    seen = set()
+    pairs = []
+    for old_ln, new_list in candidates.items():
+        for new_ln in new_list:
+            if new_ln not in new_dict:
+                continue
+            if new_ln not in seen:
+                seen.add(new_ln)
+                chunk_new.append(new_dict[new_ln])
+            pairs.append((old_ln, new_ln))
+    return score_pairs(build_scorer(chunk_old, chunk_new, old_index=old_index), pairs, threshold=threshold)
+
+
+def resolve_within_budget(unmatched_old, unmatched_new, threshold, memory_budget, k=15, anchor_map=None,
+                          old_index=None):
+    """
+    Steps 3-4 under a memory budget. Old lines are processed in chunks sized
+    so one chunk's candidate lists and scoring state fit in half the budget;
+    only one chunk's candidates are alive at a time. Scored pairs are
+    buffered and spilled as sorted runs to a temporary file once they fill
+    the other half, then greedily assigned from a k-way merge of the runs.
+    Chunks and the merge keep scoring order, so the result equals the
+    in-memory path. The unmatched pools themselves are not counted, nor is
+    an old_index passed in by the caller.
+    """
+    new_dict = make_record_dict(unmatched_new)
+    if anchor_map is not None:
+        index = anchored_index(unmatched_new, anchor_map)
+    else:
+        index = fingerprint_index(unmatched_new)
+    chunk_lines = max(1, (memory_budget // 2) // (max(k, 1) * CANDIDATE_BYTES))
+    spill_pairs = max(1, (memory_budget // 2) // PAIR_BYTES)
+
+    with tempfile.TemporaryFile() as handle:
+        runs = []
+        buffer = []
+        seq = 0
+
+        for start in range(0, len(unmatched_old), chunk_lines):
+            chunk_old = unmatched_old[start:start + chunk_lines]
+            if anchor_map is not None:
+                candidates = get_anchored_candidate_sets(
+                    chunk_old, unmatched_new, anchor_map, k=k, index=index, old_index=old_index
+                )
+            else:
+                candidates = get_candidate_sets(
+                    chunk_old, unmatched_new, k=k, heap=True, new_index=index, old_index=old_index
+                )
+
+            scored = score_candidate_chunk(chunk_old, new_dict, candidates, threshold, old_index=old_index)
+            for score, old_ln, new_ln in scored:
+                buffer.append((score, seq, old_ln, new_ln))
+                seq += 1
+            del candidates
+
+            if len(buffer) >= spill_pairs:
+                buffer.sort(key=lambda pair: (-pair[0], pair[1]))
+                runs.append(write_run(handle, buffer))
+                buffer = []
+
+        if buffer:
+            buffer.sort(key=lambda pair: (-pair[0], pair[1]))
+            runs.append(write_run(handle, buffer))
+            buffer = []
+
+        merged = merge_runs(handle, runs, memory_budget)
+        return assign_sorted(((score, old_ln, new_ln) for score, _, old_ln, new_ln in merged), unmatched_old)
+
+
+def resolve_best_matches(unmatched_old, unmatched_new, candidates, threshold=0.5, workers=1, old_index=None):
+    """
+    Score each candidate pair using combined similarity and greedily assign
+    best matches so each new line is used at most once. Anything below the
+    threshold is marked deleted (-1). workers > 1 scores chunks of old lines
+    in separate processes before the same greedy assignment (not with an
+    old_index, whose features are already built in this process). Under a
+    memory budget use resolve_within_budget, which also runs Step 3 per chunk.
+    """
+    if old_index is None and workers > 1 and sum(len(new_list) for new_list in candidates.values()) >= PARALLEL_MIN_SCORES:
+        from parallel_match import parallel_scored_pairs
+        scored_pairs = parallel_scored_pairs(unmatched_old, unmatched_new, candidates, threshold, workers)
+        return assign_greedy(scored_pairs, unmatched_old)
+
+    scored_pairs = score_candidates(unmatched_old, unmatched_new, candidates, threshold=threshold,
+                                    old_index=old_index)
+    return assign_greedy(scored_pairs, unmatched_old)
+
+
 def print_some_candidates(candidates, limit=5):
     """Print a subset of candidate line lists for manual inspection."""
     count = 0
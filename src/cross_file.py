@@ -0,0 +1,301 @@
+"""
+Cross-file line mapping for change sets.
+
+Each pair first runs Steps 1-5 on its own. Old lines still marked -1 are then
+looked up in one shared index over the unused new lines of every file in the
+change set, so a method moved from one class to another maps to its new
+file instead of being reported as deleted.
+
+The index is a bucketed LSH table. Each 64-bit SimHash is cut into bands
+and a line is filed under every (band, value) bucket, so lines that differ
+in fewer bits than there are bands share a bucket. SimHash is noisy on
+short lines, so each distinct token is a bucket key as well. Oversized
+buckets are skipped at query time, and a query only scores the lines in its
+own buckets. The work therefore grows with the total number of leftover
+lines rather than with the number of file pairs squared.
+
+A single similar line is weak evidence: generic lines such as "return null;"
+or "} else {" occur in every file. A cross-file pair only takes part in
+the one-to-one assignment when it has context. It must either be part of a run of at least MIN_RUN consecutive
+old lines mapped to consecutive lines of the same target file (the block
+idea from block_move_detect.py), or be a line with at least
+MIN_UNIQUE_TOKENS distinct tokens whose text occurs once among the leftover
+old lines and once among the indexed new lines of the change set, and
+that scores at least STANDALONE_THRESHOLD.
+"""
+import sys
+import os
+
+from preprocess import preprocess_file_bulk
+from main import match_records_with_pools
+from utils import simhash, tokenize, combined_similarity, filter_records
+
+BANDS = 4
+BAND_BITS = 64 // BANDS
+# Buckets this large hold boilerplate lines that would match anything.
+MAX_BUCKET = 64
+# Only the targets sharing the most buckets with a query get a full score.
+CROSS_K = 5
+CROSS_THRESHOLD = 0.75
+# Context a match needs to be kept (see the module docstring).
+MIN_RUN = 2
+MIN_UNIQUE_TOKENS = 4
+STANDALONE_THRESHOLD = 0.9
+
+
+def bucket_keys(text):
+    """Return the SimHash band keys and token keys a line is filed under."""
+    fingerprint = simhash(text)
+    mask = (1 << BAND_BITS) - 1
+    keys = [("band", band, (fingerprint >> (band * BAND_BITS)) & mask) for band in range(BANDS)]
+    for token in sorted(set(tokenize(text))):
+        keys.append(("token", token))
+    return keys
+
+
+def map_pair(pair, skip_comments=False, **match_kwargs):
+    """
+    Run Steps 1-5 for one pair and return its mapping, splits, the records
+    left over for cross-file matching and the position of every old and new
+    line among the non-skip records. match_kwargs go to match_records.
+    """
+    old_records = preprocess_file_bulk(pair["old_path"], skip_comments=skip_comments)
+    new_records = preprocess_file_bulk(pair["new_path"], skip_comments=skip_comments)
+
+    merged_map, split_map, unmatched_old, unmatched_new = match_records_with_pools(
+        old_records, new_records, **match_kwargs
+    )
+
+    used_new = set(merged_map.values())
+    for new_lines in split_map.values():
+        used_new.update(new_lines)
+
+    leftover_old = [record for record in unmatched_old if merged_map.get(record["line_no"]) == -1]
+    leftover_new = [record for record in unmatched_new if record["line_no"] not in used_new]
+
+    positions = {
+        "old": {record["line_no"]: index for index, record in enumerate(filter_records(old_records, keep_skip=False))},
+        "new": {record["line_no"]: index for index, record in enumerate(filter_records(new_records, keep_skip=False))}
+    }
+
+    return merged_map, split_map, leftover_old, leftover_new, positions
+
+
+def build_index(leftovers):
+    """Index the leftover new lines of every pair: {bucket key: [(pair_index, record), ...]}."""
+    index = {}
+    for pair_index, (leftover_old, leftover_new) in enumerate(leftovers):
+        for record in leftover_new:
+            if not tokenize(record["norm"]):
+                continue
+            for key in bucket_keys(record["norm"]):
+                if key not in index:
+                    index[key] = []
+                index[key].append((pair_index, record))
+    return index
+
+
+def score_cross_file(leftovers, index, threshold=CROSS_THRESHOLD):
+    """
+    Score each leftover old line against the indexed lines of the other
+    files that share the most buckets with it. Returns
+    (score, pair_index, old_ln, target_pair_index, new_ln) tuples that reach
+    the threshold, best first.
+    """
+    scored_pairs = []
+
+    for pair_index, (leftover_old, leftover_new) in enumerate(leftovers):
+        for record in leftover_old:
+            if not tokenize(record["norm"]):
+                continue
+
+            hits = {}
+            targets = {}
+            for key in bucket_keys(record["norm"]):
+                bucket = index.get(key, [])
+                if len(bucket) > MAX_BUCKET:
+                    continue
+                for target_index, target in bucket:
+                    # Same-file candidates already had their chance in Steps 3-4.
+                    if target_index == pair_index:
+                        continue
+                    target_key = (target_index, target["line_no"])
+                    hits[target_key] = hits.get(target_key, 0) + 1
+                    targets[target_key] = target
+
+            best = sorted(hits, key=lambda target_key: hits[target_key], reverse=True)[:CROSS_K]
+            for target_key in best:
+                score = combined_similarity(record["norm"], targets[target_key]["norm"])
+                if score >= threshold:
+                    scored_pairs.append((score, pair_index, record["line_no"], target_key[0], target_key[1]))
+
+    scored_pairs.sort(key=lambda item: item[0], reverse=True)
+    return scored_pairs
+
+
+def run_lengths(scored_pairs, positions):
+    """
+    Return {scored pair: length of the run it belongs to}, where a run is a
+    set of pairs from the same old file into the same target whose old and
+    new positions both advance by one line at a time.
+    """
+    # A run shares (pair, target, old position - new position) and has
+    # consecutive old positions.
+    diagonals = {}
+    keyed = []
+    for item in scored_pairs:
+        score, pair_index, old_ln, target_index, new_ln = item
+        old_pos = positions[pair_index]["old"][old_ln]
+        new_pos = positions[target_index]["new"][new_ln]
+        key = (pair_index, target_index, old_pos - new_pos)
+        if key not in diagonals:
+            diagonals[key] = set()
+        diagonals[key].add(old_pos)
+        keyed.append((item, key, old_pos))
+
+    lengths = {}
+    for item, key, old_pos in keyed:
+        run = diagonals[key]
+        length = 1
+        step = old_pos - 1
+        while step in run:
+            length += 1
+            step -= 1
+        step = old_pos + 1
+        while step in run:
+            length += 1
+            step += 1
+        lengths[item] = length
+    return lengths
+
+
+def standalone_pairs(scored_pairs, leftovers):
+    """
+    Return the scored pairs that may stand alone: near-identical, with at
+    least MIN_UNIQUE_TOKENS distinct tokens, and unique on both sides of the
+    change set.
+    """
+    old_counts = {}
+    new_counts = {}
+    old_text = {}
+    new_text = {}
+    for pair_index, (leftover_old, leftover_new) in enumerate(leftovers):
+        for record in leftover_old:
+            old_counts[record["norm"]] = old_counts.get(record["norm"], 0) + 1
+            old_text[(pair_index, record["line_no"])] = record["norm"]
+        for record in leftover_new:
+            new_counts[record["norm"]] = new_counts.get(record["norm"], 0) + 1
+            new_text[(pair_index, record["line_no"])] = record["norm"]
+
+    standalone = set()
+    for item in scored_pairs:
+        score, pair_index, old_ln, target_index, new_ln = item
+        old_norm = old_text[(pair_index, old_ln)]
+        new_norm = new_text[(target_index, new_ln)]
+        if (score >= STANDALONE_THRESHOLD
+                and len(set(tokenize(old_norm))) >= MIN_UNIQUE_TOKENS
+                and old_counts[old_norm] == 1 and new_counts[new_norm] == 1):
+            standalone.add(item)
+    return standalone
+
+
+def assign_one_to_one(scored_pairs):
+    """Greedily take the best pairs so each old and each new line is used at most once."""
+    assigned = []
+    used_old = set()
+    used_new = set()
+    for item in scored_pairs:
+        score, pair_index, old_ln, target_index, new_ln = item
+        if (pair_index, old_ln) in used_old:
+            continue
+        if (target_index, new_ln) in used_new:
+            continue
+        used_old.add((pair_index, old_ln))
+        used_new.add((target_index, new_ln))
+        assigned.append(item)
+    return assigned
+
+
+def resolve_cross_file(leftovers, index, positions, threshold=CROSS_THRESHOLD):
+    """
+    Score the leftover old lines against the other files, keep only pairs
+    with context and assign them one-to-one across the change set. Pairs
+    without context (see the module docstring) never enter the assignment,
+    so a generic line cannot claim a new line a run member needs. If the
+    assignment itself breaks a run, the pairs left without context are
+    dropped and the assignment is redone until every kept match has context.
+    Returns {pair_index: {old_ln: (target_pair_index, new_ln)}}.
+    """
+    scored_pairs = score_cross_file(leftovers, index, threshold=threshold)
+    standalone = standalone_pairs(scored_pairs, leftovers)
+
+    candidates = scored_pairs
+    while True:
+        lengths = run_lengths(candidates, positions)
+        candidates = [item for item in candidates if lengths[item] >= MIN_RUN or item in standalone]
+        assigned = assign_one_to_one(candidates)
+        lengths = run_lengths(assigned, positions)
+        lacking = set(item for item in assigned if lengths[item] < MIN_RUN and item not in standalone)
+        if not lacking:
+            break
+        candidates = [item for item in candidates if item not in lacking]
+
+    cross_maps = {}
+    for score, pair_index, old_ln, target_index, new_ln in assigned:
+        if pair_index not in cross_maps:
+            cross_maps[pair_index] = {}
+        cross_maps[pair_index][old_ln] = (target_index, new_ln)
+    return cross_maps
+
+
+def run_change_set(pairs, threshold=CROSS_THRESHOLD, skip_comments=False, **match_kwargs):
+    """
+    Map every pair in a change set, then resolve cross-file moves. Returns a
+    list of (merged_map, split_map, cross_map) per pair, where cross_map is
+    {old_ln: (target_file_name, new_ln)} for lines that moved to another file.
+    In-file mappings keep -1 for those lines. skip_comments and match_kwargs
+    are the usual per-pair pipeline options.
+    """
+    results = []
+    leftovers = []
+    positions = []
+    for pair in pairs:
+        merged_map, split_map, leftover_old, leftover_new, pair_positions = map_pair(
+            pair, skip_comments=skip_comments, **match_kwargs
+        )
+        results.append((merged_map, split_map))
+        leftovers.append((leftover_old, leftover_new))
+        positions.append(pair_positions)
+
+    index = build_index(leftovers)
+    cross_maps = resolve_cross_file(leftovers, index, positions, threshold=threshold)
+
+    output = []
+    for pair_index, (merged_map, split_map) in enumerate(results):
+        cross_map = {}
+        for old_ln, (target_index, new_ln) in cross_maps.get(pair_index, {}).items():
+            cross_map[old_ln] = (os.path.basename(pairs[target_index]["new_path"]), new_ln)
+        output.append((merged_map, split_map, cross_map))
+    return output
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 5 or len(sys.argv) % 2 == 0:
+        print("Usage:")
+        print("  python cross_file.py <old_file> <new_file> <old_file> <new_file> [...]")
+        raise SystemExit(1)
+
+    pairs = []
+    for position in range(1, len(sys.argv), 2):
+        old_path = sys.argv[position]
+        pairs.append({
+            "name": os.path.splitext(os.path.basename(old_path))[0],
+            "old_path": old_path,
+            "new_path": sys.argv[position + 1]
+        })
+
+    for pair, (merged_map, split_map, cross_map) in zip(pairs, run_change_set(pairs)):
+        print(pair["name"] + ": cross-file matches:", len(cross_map))
+        for old_ln in sorted(cross_map):
+            target_file, new_ln = cross_map[old_ln]
+            print("  " + str(old_ln) + " -> " + target_file + ":" + str(new_ln))
@@ -2,37 +2,15 @@ import argparse
 
 from provided_loader import load_provided_pairs
 from my_dataset_loader import load_my_dataset_pairs
-from preprocess import preprocess_file
-from unchanged_detect import detect_unchanged
-from candidate_match import get_candidate_sets, resolve_best_matches
-from split_detect import detect_splits
+from main import run_pipeline
 from metrics import score_mapping, accuracy_percent
 
 
-def run_pipeline(old_path, new_path):
-    """Run Steps 1-5 and return the merged line mapping."""
-    old_records = preprocess_file(old_path)
-    new_records = preprocess_file(new_path)
-
-    unchanged_map, unmatched_old, unmatched_new = detect_unchanged(old_records, new_records)
-
-    candidates = get_candidate_sets(unmatched_old, unmatched_new, k=15)
-    match_map, match_scores = resolve_best_matches(unmatched_old, unmatched_new, candidates, threshold=0.5)
-
-    final_map, split_map = detect_splits(unmatched_old, unmatched_new, match_map, threshold_gain=0.02, max_extra=4)
-
-    merged_map = {}
-    for old_line, new_line in unchanged_map.items():
-        merged_map[old_line] = new_line
-    for old_line, new_line in final_map.items():
-        merged_map[old_line] = new_line
-
-    return merged_map
-
-
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--dataset", choices=["provided", "my_dataset"], required=True)
+    parser.add_argument("--anchored", action="store_true",
+                        help="search Step 3 candidates between neighbouring unchanged lines before the whole file")
     args = parser.parse_args()
 
     if args.dataset == "provided":
@@ -51,7 +29,7 @@ def main():
         new_path = pair["new_path"]
         truth = pair["truth"]
 
-        predicted = run_pipeline(old_path, new_path)
+        predicted, _ = run_pipeline(old_path, new_path, anchored=args.anchored)
 
         correct, total = score_mapping(predicted, truth)
         overall_correct += correct
@@ -0,0 +1,203 @@
+"""
+Fan-out mode: map one old file against many new versions of it.
+
+prepare_old() does the old-side work once: it reads and normalizes the
+file, interns its normalized lines to integer ids for Step 2 and block
+moves, and builds an old index (SimHash fingerprints plus the token-count
+matrix Step 4 scores against). Each target then only preprocesses its own
+new file, interns it against the old id table, and runs Steps 2-5 with the
+prepared old ids and index passed in explicitly. The mapping for a target
+is the same as run_pipeline(old_path, new_path). Step 5 still scores old
+lines from their text.
+
+With workers > 1, targets run in worker processes. Each worker receives
+the prepared old side once at start-up, and each task carries only a path.
+"""
+import sys
+import os
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from preprocess import preprocess_file_bulk
+from unchanged_detect import unchanged_from_keys
+from main import extend_anchors, match_unmatched
+from candidate_match import build_old_index
+from utils import filter_records, save_prediction_xml, merge_mappings
+
+_worker_state = None
+
+
+def prepare_old(old_path, skip_comments=False):
+    """Preprocess the old file once and return the state every target reuses."""
+    records = preprocess_file_bulk(old_path, skip_comments=skip_comments)
+    work = filter_records(records, keep_skip=False)
+
+    line_ids = {}
+    old_ids = []
+    for record in work:
+        old_ids.append(line_ids.setdefault(record["norm"], len(line_ids)))
+
+    return {
+        "path": old_path,
+        "skip_comments": skip_comments,
+        "work": work,
+        "line_ids": line_ids,
+        "old_ids": old_ids,
+        "old_id_by_line": {record["line_no"]: line_id for record, line_id in zip(work, old_ids)},
+        "old_index": build_old_index(work)
+    }
+
+
+def intern_new(prepared, new_work):
+    """
+    Give each new line the id of the identical old line, or a fresh id past
+    the old table. The old table itself is left unchanged, so targets stay
+    independent of each other.
+    """
+    line_ids = prepared["line_ids"]
+    fresh = {}
+    new_ids = []
+    for record in new_work:
+        norm = record["norm"]
+        if norm in line_ids:
+            new_ids.append(line_ids[norm])
+        else:
+            new_ids.append(fresh.setdefault(norm, len(line_ids) + len(fresh)))
+    return new_ids
+
+
+def map_target(prepared, new_path, k=15, threshold=0.5, threshold_gain=0.02, max_extra=4,
+               block_moves=True, anchored=False):
+    """Run Steps 2-5 for one new version against the prepared old side."""
+    new_records = preprocess_file_bulk(new_path, skip_comments=prepared["skip_comments"])
+    new_work = filter_records(new_records, keep_skip=False)
+
+    new_ids = intern_new(prepared, new_work)
+    unchanged_map, unmatched_old, unmatched_new = unchanged_from_keys(
+        prepared["work"], new_work, prepared["old_ids"], new_ids
+    )
+
+    # Block moves reuse the Step 2 ids instead of interning both pools again.
+    new_id_by_line = {record["line_no"]: line_id for record, line_id in zip(new_work, new_ids)}
+    block_ids = (
+        [prepared["old_id_by_line"][record["line_no"]] for record in unmatched_old],
+        [new_id_by_line[record["line_no"]] for record in unmatched_new]
+    )
+    anchor_map, unmatched_old, unmatched_new = extend_anchors(
+        unchanged_map, unmatched_old, unmatched_new, block_moves=block_moves, block_ids=block_ids
+    )
+
+    final_map, split_map = match_unmatched(
+        unmatched_old, unmatched_new, k=k, threshold=threshold, threshold_gain=threshold_gain,
+        max_extra=max_extra, anchor_map=anchor_map if anchored else None, old_index=prepared["old_index"]
+    )
+
+    return merge_mappings(anchor_map, final_map), split_map
+
+
+def _run_target(prepared, new_path, match_kwargs):
+    """Map one target and return a result dict; errors are reported, not raised."""
+    started = time.perf_counter()
+    try:
+        mapping, split_map = map_target(prepared, new_path, **match_kwargs)
+    except Exception as error:
+        return {"new": new_path, "error": str(error)}
+    return {
+        "new": new_path,
+        "mapping": mapping,
+        "splits": split_map,
+        "seconds": time.perf_counter() - started
+    }
+
+
+def _init_worker(prepared):
+    """Keep the prepared old side, index included, in the worker."""
+    global _worker_state
+    _worker_state = prepared
+
+
+def _worker_target(new_path, match_kwargs):
+    return _run_target(_worker_state, new_path, match_kwargs)
+
+
+def fan_out(prepared, new_paths, workers=1, **match_kwargs):
+    """
+    Map every new path against the prepared old side and yield one result
+    dict per target, in input order, as soon as it is ready. Each result has
+    mapping, splits and seconds, or error if the target failed.
+    """
+    if workers <= 1:
+        for new_path in new_paths:
+            yield _run_target(prepared, new_path, match_kwargs)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(prepared,)) as executor:
+        futures = [executor.submit(_worker_target, new_path, match_kwargs) for new_path in new_paths]
+        for future in futures:
+            yield future.result()
+
+
+def read_target_list(path):
+    """Read new file paths, one per line, from a file or - for stdin."""
+    handle = sys.stdin if path == "-" else open(path, "r", encoding="utf8")
+    try:
+        return [line.strip() for line in handle if line.strip()]
+    finally:
+        if handle is not sys.stdin:
+            handle.close()
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Map one old file against many new versions of it.")
+    parser.add_argument("old", help="baseline file")
+    parser.add_argument("new", nargs="*", help="new versions to map against the baseline")
+    parser.add_argument("--targets", help="file listing one new path per line, or - for stdin")
+    parser.add_argument("--workers", type=int, default=1, help="map targets in this many processes")
+    parser.add_argument("--out-dir", help="write <target name>.xml here instead of inlining mappings in the output")
+    parser.add_argument("--skip-comments", action="store_true",
+                        help="leave Java comment-only lines out of the mapping like blank lines")
+    parser.add_argument("--anchored", action="store_true",
+                        help="search Step 3 candidates between neighbouring unchanged lines before the whole file")
+    args = parser.parse_args()
+
+    new_paths = list(args.new)
+    if args.targets:
+        new_paths.extend(read_target_list(args.targets))
+    if not new_paths:
+        parser.error("no new files given")
+
+    started = time.perf_counter()
+    prepared = prepare_old(args.old, skip_comments=args.skip_comments)
+    prepare_seconds = time.perf_counter() - started
+    sys.stderr.write("Prepared " + args.old + " in " + format(prepare_seconds, ".3f") + "s\n")
+
+    failures = 0
+    for result in fan_out(prepared, new_paths, workers=args.workers, anchored=args.anchored):
+        if "error" in result:
+            failures += 1
+            sys.stdout.write(json.dumps(result) + "\n")
+            sys.stdout.flush()
+            continue
+
+        name = os.path.splitext(os.path.basename(result["new"]))[0]
+        line = {"name": name, "old": args.old, "new": result["new"]}
+        if args.out_dir:
+            out_path = os.path.join(args.out_dir, name + ".xml")
+            save_prediction_xml(name, result["mapping"], result["splits"], out_path)
+            line["out"] = out_path
+        else:
+            line["mapping"] = [[old_ln, result["mapping"][old_ln]] for old_ln in sorted(result["mapping"])]
+            line["splits"] = [[old_ln, result["splits"][old_ln]] for old_ln in sorted(result["splits"])]
+        line["seconds"] = round(result["seconds"], 6)
+        sys.stdout.write(json.dumps(line) + "\n")
+        sys.stdout.flush()
+
+    if failures:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,49 +3,214 @@ import os
 
 from provided_loader import load_provided_pairs
 from my_dataset_loader import load_my_dataset_pairs
-from preprocess import preprocess_file
+from preprocess import preprocess_file_bulk
 from unchanged_detect import detect_unchanged
-from candidate_match import get_candidate_sets, resolve_best_matches
+from block_move_detect import detect_block_moves
+from candidate_match import get_candidate_sets, get_anchored_candidate_sets, resolve_best_matches, resolve_within_budget
 from split_detect import detect_splits
-from utils import save_prediction_xml
+from utils import save_prediction_xml, parse_size, merge_mappings
+
+
+def run_pipeline(old_path, new_path, k=15, threshold=0.5, threshold_gain=0.02, max_extra=4,
+                 block_moves=True, skip_comments=False, memory_budget=None, workers=1, anchored=False):
+    """
+    Run Steps 1-5 and return the merged line mapping plus any splits.
+    memory_budget (bytes) runs Steps 3-4 on chunks of old lines sized to the
+    budget, spilling scored pairs to disk; workers > 1 splits Steps 3-4 of
+    this pair across processes. Neither changes the mapping. anchored=True
+    searches Step 3 candidates in the gaps between Step 2 anchors first.
+    """
+    old_records = preprocess_file_bulk(old_path, skip_comments=skip_comments)
+    new_records = preprocess_file_bulk(new_path, skip_comments=skip_comments)
+
+    return match_records(
+        old_records, new_records, k=k, threshold=threshold, threshold_gain=threshold_gain,
+        max_extra=max_extra, block_moves=block_moves, memory_budget=memory_budget, workers=workers,
+        anchored=anchored
+    )
+
+
+def match_records(old_records, new_records, **options):
+    """
+    Run Steps 2-5 on already preprocessed records and merge the mappings.
+    Takes the same options as match_records_with_pools.
+    """
+    merged_map, split_map, unmatched_old, unmatched_new = match_records_with_pools(old_records, new_records, **options)
+    return merged_map, split_map
+
+
+def match_records_with_pools(old_records, new_records, k=15, threshold=0.5, threshold_gain=0.02, max_extra=4,
+                             block_moves=True, memory_budget=None, workers=1, anchored=False):
+    """
+    match_records that also returns the unmatched_old/unmatched_new pools
+    Steps 3-5 worked on, for callers that post-process leftover lines.
+    """
+    anchor_map, unmatched_old, unmatched_new = detect_anchors(old_records, new_records, block_moves=block_moves)
+
+    final_map, split_map = match_unmatched(
+        unmatched_old, unmatched_new, k=k, threshold=threshold, threshold_gain=threshold_gain,
+        max_extra=max_extra, memory_budget=memory_budget, workers=workers,
+        anchor_map=anchor_map if anchored else None
+    )
 
+    return merge_mappings(anchor_map, final_map), split_map, unmatched_old, unmatched_new
 
-def run_pipeline(old_path, new_path):
-    old_records = preprocess_file(old_path)
-    new_records = preprocess_file(new_path)
 
+def detect_anchors(old_records, new_records, block_moves=True):
+    """Step 2 plus block move detection: exact matches and the pools left over."""
     unchanged_map, unmatched_old, unmatched_new = detect_unchanged(old_records, new_records)
+    return extend_anchors(unchanged_map, unmatched_old, unmatched_new, block_moves=block_moves)
+
+
+def extend_anchors(unchanged_map, unmatched_old, unmatched_new, block_moves=True, block_ids=None):
+    """
+    Add block moves to the Step 2 matches; same return value as detect_anchors.
+    block_ids is passed to detect_block_moves as its precomputed line ids.
+    """
+    anchor_map = {}
+    for old_line, new_line in unchanged_map.items():
+        anchor_map[old_line] = new_line
+
+    if block_moves:
+        block_map, unmatched_old, unmatched_new = detect_block_moves(
+            unmatched_old, unmatched_new, min_lines=3, ids=block_ids
+        )
+        for old_line, new_line in block_map.items():
+            anchor_map[old_line] = new_line
+
+    return anchor_map, unmatched_old, unmatched_new
+
+
+def match_unmatched(unmatched_old, unmatched_new, k=15, threshold=0.5, threshold_gain=0.02, max_extra=4,
+                    memory_budget=None, splits=True, workers=1, anchor_map=None, old_index=None):
+    """
+    Steps 3-5 on the unmatched pools; splits=False skips Step 5. Given an
+    anchor_map, Step 3 searches the gaps between anchors before the whole file.
+    A memory_budget runs Steps 3-4 chunk by chunk (workers is then ignored).
+    old_index, from build_old_index, supplies the old side's Step 3-4
+    features instead of computing them from the pool.
+    """
+    if memory_budget is not None:
+        match_map, match_scores = resolve_within_budget(
+            unmatched_old, unmatched_new, threshold, memory_budget, k=k, anchor_map=anchor_map,
+            old_index=old_index
+        )
+    else:
+        if anchor_map is not None:
+            candidates = get_anchored_candidate_sets(
+                unmatched_old, unmatched_new, anchor_map, k=k, old_index=old_index
+            )
+        else:
+            candidates = get_candidate_sets(unmatched_old, unmatched_new, k=k, workers=workers, old_index=old_index)
+        match_map, match_scores = resolve_best_matches(
+            unmatched_old, unmatched_new, candidates, threshold=threshold, workers=workers, old_index=old_index
+        )
+        # Candidate lists are not needed by Step 5; release them before it runs.
+        del candidates
+
+    if not splits:
+        return match_map, {}
+
+    return detect_splits(unmatched_old, unmatched_new, match_map, threshold_gain=threshold_gain, max_extra=max_extra)
+
+
+def run_staged_dataset(args, loader, out_dir):
+    """Run a dataset through the staged discover/read/match/write pipeline; exits 1 if any pair failed."""
+    # Deferred so plain runs and batch.py do not pay for multiprocessing imports.
+    from staged_pipeline import run_staged, print_stage_report
+
+    def load(pair):
+        old_records = preprocess_file_bulk(pair["old_path"], skip_comments=args.skip_comments)
+        new_records = preprocess_file_bulk(pair["new_path"], skip_comments=args.skip_comments)
+        return old_records, new_records
+
+    def write(pair, result):
+        mapping, split_map = result
+        out_path = os.path.join(out_dir, pair["name"] + ".xml")
+        save_prediction_xml(pair["name"], mapping, split_map, out_path)
+        print("Saved:", out_path)
 
-    candidates = get_candidate_sets(unmatched_old, unmatched_new, k=15)
-    match_map, match_scores = resolve_best_matches(unmatched_old, unmatched_new, candidates, threshold=0.5)
+    report = run_staged(
+        loader, load, match_records, write,
+        match_kwargs={"memory_budget": args.memory_budget, "anchored": args.anchored},
+        read_threads=args.read_threads, workers=args.workers, queue_size=args.queue_size
+    )
+    print_stage_report(report)
+    if report["errors"]:
+        raise SystemExit(1)
 
-    final_map, split_map = detect_splits(unmatched_old, unmatched_new, match_map, threshold_gain=0.02, max_extra=4)
 
-    merged_map = {}
-    for k in unchanged_map:
-        merged_map[k] = unchanged_map[k]
-    for k in final_map:
-        merged_map[k] = final_map[k]
+def run_cross_file_dataset(args, loader, out_dir):
+    """Map every pair, then resolve lines that moved between files of the dataset."""
+    from cross_file import run_change_set
 
-    return merged_map, split_map
+    pairs = loader()
+    print("Pairs found:", len(pairs))
+
+    results = run_change_set(
+        pairs, skip_comments=args.skip_comments, memory_budget=args.memory_budget,
+        workers=args.pair_workers, anchored=args.anchored
+    )
+
+    for pair, (mapping, split_map, cross_map) in zip(pairs, results):
+        out_path = os.path.join(out_dir, pair["name"] + ".xml")
+        save_prediction_xml(pair["name"], mapping, split_map, out_path, cross_map=cross_map)
+        print("Saved:", out_path, "(cross-file: " + str(len(cross_map)) + ")")
 
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--dataset", choices=["provided", "my_dataset"], required=True)
+    parser.add_argument("--skip-comments", action="store_true",
+                        help="leave Java comment-only lines out of the mapping like blank lines")
+    parser.add_argument("--memory-budget", type=parse_size,
+                        help="bound Step 3-4 candidate and scored-pair memory, e.g. 64M; old lines run in chunks "
+                             "and scored pairs spill to a temp file")
+    parser.add_argument("--pair-workers", type=int, default=1,
+                        help="split Steps 3-4 of each pair across this many processes")
+    parser.add_argument("--anchored", action="store_true",
+                        help="search Step 3 candidates between neighbouring unchanged lines before the whole file")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--latency-budget", type=float,
+                      help="seconds per pair; picks a cheaper quality tier when the full pipeline would not fit")
+    mode.add_argument("--cross-file", action="store_true",
+                      help="treat the dataset as one change set and map lines that moved between files")
+    mode.add_argument("--staged", action="store_true",
+                      help="overlap reading, matching and writing with bounded queues between stages")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="match processes for --staged (0 matches in a thread)")
+    parser.add_argument("--read-threads", type=int, default=2, help="reader threads for --staged")
+    parser.add_argument("--queue-size", type=int, default=8, help="capacity of each stage queue for --staged")
     args = parser.parse_args()
 
+    # --staged already runs matches in worker processes, which cannot start their own.
+    if args.staged and args.pair_workers > 1:
+        parser.error("--pair-workers cannot be combined with --staged; use --workers")
+    if args.read_threads < 1 or args.queue_size < 1:
+        parser.error("--read-threads and --queue-size must be at least 1")
+    if args.workers < 0:
+        parser.error("--workers must not be negative")
+
     here = os.path.dirname(__file__)
 
     if args.dataset == "provided":
         print("Loading dataset: provided")
-        pairs = load_provided_pairs()
+        loader = load_provided_pairs
         out_dir = os.path.join(here, "..", "results", "provided_predictions")
     else:
         print("Loading dataset: my_dataset")
-        pairs = load_my_dataset_pairs()
+        loader = load_my_dataset_pairs
         out_dir = os.path.join(here, "..", "results", "my_dataset_predictions")
 
+    if args.staged:
+        run_staged_dataset(args, loader, out_dir)
+        return
+
+    if args.cross_file:
+        run_cross_file_dataset(args, loader, out_dir)
+        return
+
+    pairs = loader()
     print("Pairs found:", len(pairs))
 
     for pair in pairs:
@@ -55,10 +220,22 @@ def main():
 
         print("Processing", name)
 
-        mapping, split_map = run_pipeline(old_path, new_path)
+        tier = None
+        if args.latency_budget is not None:
+            from adaptive import run_adaptive_pipeline
+            mapping, split_map, tier = run_adaptive_pipeline(
+                old_path, new_path, args.latency_budget, skip_comments=args.skip_comments,
+                memory_budget=args.memory_budget, workers=args.pair_workers, anchored=args.anchored
+            )
+            print("Tier:", tier)
+        else:
+            mapping, split_map = run_pipeline(
+                old_path, new_path, skip_comments=args.skip_comments, memory_budget=args.memory_budget,
+                workers=args.pair_workers, anchored=args.anchored
+            )
 
         out_path = os.path.join(out_dir, name + ".xml")
-        save_prediction_xml(name, mapping, split_map, out_path)
+        save_prediction_xml(name, mapping, split_map, out_path, tier=tier)
 
         print("Saved:", out_path)
 
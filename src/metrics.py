@@ -1,3 +1,7 @@
+import operator
+from array import array
+
+
 def score_mapping(predicted, truth):
     """Return (correct, total) counts by comparing predicted mappings to truth."""
     correct = 0
@@ -16,3 +20,21 @@ def accuracy_percent(correct, total):
     if total == 0:
         return 0.0
     return (correct / total) * 100.0
+
+
+# Placeholder for old lines a mapping does not mention.
+MISSING = -2
+
+
+def mapping_array(mapping, size):
+    """Return the mapping as array("q") indexed by old line number, MISSING where unmapped."""
+    values = array("q", [MISSING]) * size
+    for old_line, new_line in mapping.items():
+        if 0 <= old_line < size:
+            values[old_line] = new_line
+    return values
+
+
+def score_arrays(truth_new, predicted_new):
+    """Return (correct, total) for two aligned arrays of new line numbers."""
+    return sum(map(operator.eq, truth_new, predicted_new)), len(truth_new)
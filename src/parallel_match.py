@@ -0,0 +1,181 @@
+"""
+Intra-pair parallel Steps 3-4.
+
+The unmatched old lines are split into chunks that run in worker processes.
+Fingerprints, line numbers and normalized text for both pools are packed once
+into a multiprocessing.shared_memory block, so a task only carries its chunk
+bounds (and, for Step 4, its candidate indices) instead of pickled records.
+Chunk results come back in old-line order, which makes the merged candidate
+lists and scored pairs identical to the serial run.
+"""
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import heapq
+
+from utils import simhash, hamming_distance
+from candidate_match import build_scorer, score_pairs
+
+CHUNKS_PER_WORKER = 4
+
+
+def _pack_pools(unmatched_old, unmatched_new):
+    """
+    Copy both pools into one shared memory block. Returns the block and a
+    small layout dict ({field: (offset, typecode, count)}) for the workers.
+    """
+    fields = {}
+    for side, records in (("old", unmatched_old), ("new", unmatched_new)):
+        encoded = [record["norm"].encode("utf8", "surrogatepass") for record in records]
+        offsets = array("q", [0])
+        for text in encoded:
+            offsets.append(offsets[-1] + len(text))
+        fields[side + "_line_no"] = array("q", [record["line_no"] for record in records])
+        fields[side + "_fp"] = array("Q", [simhash(record["norm"]) for record in records])
+        fields[side + "_text_offsets"] = offsets
+        fields[side + "_text"] = array("B", b"".join(encoded))
+
+    layout = {}
+    position = 0
+    for name, values in fields.items():
+        # Keep every field 8-byte aligned so memoryview casts are valid.
+        position = (position + 7) // 8 * 8
+        layout[name] = (position, values.typecode, len(values))
+        position += len(values) * values.itemsize
+
+    block = shared_memory.SharedMemory(create=True, size=max(position, 1))
+    for name, values in fields.items():
+        offset = layout[name][0]
+        data = values.tobytes()
+        block.buf[offset:offset + len(data)] = data
+
+    return block, {"name": block.name, "fields": layout}
+
+
+class _SharedPools:
+    """Worker-side read-only views over a packed shared memory block."""
+
+    def __init__(self, layout):
+        self.block = shared_memory.SharedMemory(name=layout["name"])
+        self.views = {}
+        for name, (offset, typecode, count) in layout["fields"].items():
+            size = count * array(typecode).itemsize
+            self.views[name] = self.block.buf[offset:offset + size].cast(typecode)
+
+    def text(self, side, index):
+        offsets = self.views[side + "_text_offsets"]
+        raw = self.views[side + "_text"][offsets[index]:offsets[index + 1]]
+        return bytes(raw).decode("utf8", "surrogatepass")
+
+    def close(self):
+        for view in self.views.values():
+            view.release()
+        self.views = {}
+        self.block.close()
+
+
+def _candidate_chunk(layout, start, stop, k):
+    """Top-k new line numbers by Hamming distance for old indices [start, stop)."""
+    pools = _SharedPools(layout)
+    try:
+        new_fps = pools.views["new_fp"]
+        new_line_nos = pools.views["new_line_no"]
+        old_fps = pools.views["old_fp"]
+        old_line_nos = pools.views["old_line_no"]
+
+        result = []
+        for index in range(start, stop):
+            old_fp = old_fps[index]
+            nearest = heapq.nsmallest(
+                k, ((hamming_distance(old_fp, new_fps[j]), j) for j in range(len(new_fps))),
+                key=lambda pair: pair[0]
+            )
+            result.append((old_line_nos[index], [new_line_nos[j] for _, j in nearest]))
+        return result
+    finally:
+        pools.close()
+
+
+def _score_chunk(layout, items, threshold):
+    """
+    Score (old index, [new index, ...]) items with the serial Step 4 scorer
+    and keep pairs at or above threshold.
+    """
+    pools = _SharedPools(layout)
+    try:
+        old_line_nos = pools.views["old_line_no"]
+        new_line_nos = pools.views["new_line_no"]
+
+        chunk_old = [{"line_no": old_line_nos[old_index], "norm": pools.text("old", old_index)}
+                     for old_index, _ in items]
+        needed = sorted(set(new_index for _, new_indexes in items for new_index in new_indexes))
+        chunk_new = [{"line_no": new_line_nos[new_index], "norm": pools.text("new", new_index)}
+                     for new_index in needed]
+
+        pairs = []
+        for old_index, new_indexes in items:
+            for new_index in new_indexes:
+                pairs.append((old_line_nos[old_index], new_line_nos[new_index]))
+
+        return score_pairs(build_scorer(chunk_old, chunk_new), pairs, threshold=threshold)
+    finally:
+        pools.close()
+
+
+def _chunk_bounds(count, workers):
+    """Split range(count) into contiguous chunks, a few per worker for balance."""
+    if count == 0:
+        return []
+    chunks = max(1, min(count, workers * CHUNKS_PER_WORKER))
+    size = (count + chunks - 1) // chunks
+    return [(start, min(start + size, count)) for start in range(0, count, size)]
+
+
+def parallel_candidate_sets(unmatched_old, unmatched_new, k, workers):
+    """Step 3 across worker processes; same result as get_candidate_sets."""
+    block, layout = _pack_pools(unmatched_old, unmatched_new)
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(_candidate_chunk, layout, start, stop, k)
+                for start, stop in _chunk_bounds(len(unmatched_old), workers)
+            ]
+            candidates = {}
+            for future in futures:
+                for old_ln, new_list in future.result():
+                    candidates[old_ln] = new_list
+        return candidates
+    finally:
+        block.close()
+        block.unlink()
+
+
+def parallel_scored_pairs(unmatched_old, unmatched_new, candidates, threshold, workers):
+    """Step 4 scoring across worker processes; same list as score_candidates."""
+    old_index = {record["line_no"]: index for index, record in enumerate(unmatched_old)}
+    new_index = {record["line_no"]: index for index, record in enumerate(unmatched_new)}
+
+    # Old lines missing from the pool score against empty text, as in the serial path.
+    items = []
+    extra_old = []
+    for old_ln, new_list in candidates.items():
+        indexes = [new_index[new_ln] for new_ln in new_list if new_ln in new_index]
+        if old_ln not in old_index:
+            extra_old.append({"line_no": old_ln, "norm": ""})
+            old_index[old_ln] = len(unmatched_old) + len(extra_old) - 1
+        items.append((old_index[old_ln], indexes))
+
+    block, layout = _pack_pools(list(unmatched_old) + extra_old, unmatched_new)
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(_score_chunk, layout, items[start:stop], threshold)
+                for start, stop in _chunk_bounds(len(items), workers)
+            ]
+            scored_pairs = []
+            for future in futures:
+                scored_pairs.extend(future.result())
+        return scored_pairs
+    finally:
+        block.close()
+        block.unlink()
@@ -1,7 +1,10 @@
 """Step 1"""
 
 import sys
-from utils import read_file_lines, collapse_whitespace, is_blank
+from utils import (
+    read_file_lines, read_file_text, split_text_lines, normalize_text,
+    java_code_text, collapse_whitespace, is_blank
+)
 
 
 def normalize_line(line, *, lowercase=True, collapse_ws=True):
@@ -42,10 +45,48 @@ def preprocess_file(path, lowercase=True, collapse_ws=True):
     return records
 
 
-def preprocess_pair(old_path, new_path, lowercase=True, collapse_ws=True):
+def preprocess_text(text, lowercase=True, collapse_ws=True, skip_comments=False):
+    """
+    Bulk variant of preprocess_file for a whole buffer. Normalization runs once
+    over the buffer and lines are split only at the end. With skip_comments,
+    Java comment-only lines are flagged skip=True like blank lines, so they
+    never reach Steps 2-5. Without it the records match preprocess_file.
+    """
+    raw_lines = split_text_lines(text)
+    norm_lines = normalize_text(text, lowercase=lowercase, collapse_ws=collapse_ws).split("\n")
+
+    code_lines = None
+    if skip_comments:
+        code_lines = java_code_text(text).split("\n")
+
+    records = []
+
+    for index, (raw, norm) in enumerate(zip(raw_lines, norm_lines)):
+        # Normalized lines are stripped, so an empty one means a blank raw line.
+        skip = norm == ""
+        if code_lines is not None and code_lines[index] == "":
+            skip = True
+
+        records.append({
+            "line_no": index + 1,
+            "raw": raw,
+            "norm": norm,
+            "skip": skip
+        })
+
+    return records
+
+
+def preprocess_file_bulk(path, lowercase=True, collapse_ws=True, skip_comments=False):
+    """Read the whole file buffer (memory-mapped when large) and preprocess it in bulk."""
+    text = read_file_text(path)
+    return preprocess_text(text, lowercase=lowercase, collapse_ws=collapse_ws, skip_comments=skip_comments)
+
+
+def preprocess_pair(old_path, new_path, lowercase=True, collapse_ws=True, skip_comments=False):
     """Convenience helper that preprocesses both old and new files."""
-    old_records = preprocess_file(old_path, lowercase=lowercase, collapse_ws=collapse_ws)
-    new_records = preprocess_file(new_path, lowercase=lowercase, collapse_ws=collapse_ws)
+    old_records = preprocess_file_bulk(old_path, lowercase=lowercase, collapse_ws=collapse_ws, skip_comments=skip_comments)
+    new_records = preprocess_file_bulk(new_path, lowercase=lowercase, collapse_ws=collapse_ws, skip_comments=skip_comments)
     return old_records, new_records
 
 
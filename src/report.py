@@ -0,0 +1,307 @@
+"""
+Evaluation report: accuracy by change type joined with per-pair timings.
+
+Every pair runs through the pipeline with Steps 1, 2 (plus block moves) and
+3-5 timed separately. Predictions are stored as array-backed mappings indexed
+by old line number. The whole dataset is then flattened into aligned arrays
+(pair, category, true new line, predicted new line); building them and
+categorizing the truth still walk each truth line in Python. Scoring works
+on whole slices of those arrays: with NumPy installed each pair's counts
+come from a few vectorized comparisons and bincounts, otherwise a
+pure-Python fallback tallies the same counts.
+
+Each truth line gets one category:
+
+- unchanged: maps to a new line with the same normalized text
+- modified: maps to a new line with different text
+- deleted: truth is -1
+- split: shares its new line with other old lines, i.e. the line was split
+  or joined across versions
+
+Errors are broken down further into wrong (mapped to another line),
+false_delete (predicted -1 for a line that survived), missed_delete (mapped
+a deleted line) and missing (no prediction at all).
+"""
+import argparse
+import csv
+import json
+import time
+import operator
+from array import array
+from bisect import bisect_left
+from itertools import compress, repeat
+
+from provided_loader import load_provided_pairs
+from my_dataset_loader import load_my_dataset_pairs
+from preprocess import preprocess_file_bulk
+from main import detect_anchors, match_unmatched
+from utils import merge_mappings
+from metrics import MISSING, mapping_array, score_arrays, accuracy_percent
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+CATEGORIES = ("unchanged", "modified", "deleted", "split")
+ERROR_KINDS = ("wrong", "false_delete", "missed_delete", "missing")
+STAGES = ("preprocess_s", "anchors_s", "match_s")
+
+
+def time_pair(pair, skip_comments=False, block_moves=True, anchored=False):
+    """
+    Run the pipeline on one pair with each stage timed. Returns the records,
+    the merged mapping (same as run_pipeline with the same options) and
+    {stage: seconds}.
+    """
+    timings = {}
+
+    started = time.perf_counter()
+    old_records = preprocess_file_bulk(pair["old_path"], skip_comments=skip_comments)
+    new_records = preprocess_file_bulk(pair["new_path"], skip_comments=skip_comments)
+    timings["preprocess_s"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    anchor_map, unmatched_old, unmatched_new = detect_anchors(old_records, new_records, block_moves=block_moves)
+    timings["anchors_s"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    final_map, split_map = match_unmatched(
+        unmatched_old, unmatched_new, anchor_map=anchor_map if anchored else None
+    )
+    timings["match_s"] = time.perf_counter() - started
+    timings["total_s"] = sum(timings[stage] for stage in STAGES)
+
+    merged_map = merge_mappings(anchor_map, final_map)
+
+    return old_records, new_records, merged_map, timings
+
+
+def categorize_truth(truth, old_records, new_records):
+    """Return {old_line: category index into CATEGORIES} for every truth line."""
+    old_text = {record["line_no"]: record["norm"] for record in old_records}
+    new_text = {record["line_no"]: record["norm"] for record in new_records}
+
+    sharing = {}
+    for new_line in truth.values():
+        if new_line != -1:
+            sharing[new_line] = sharing.get(new_line, 0) + 1
+
+    categories = {}
+    for old_line, new_line in truth.items():
+        if new_line == -1:
+            category = "deleted"
+        elif sharing[new_line] > 1:
+            category = "split"
+        elif old_text.get(old_line) == new_text.get(new_line):
+            category = "unchanged"
+        else:
+            category = "modified"
+        categories[old_line] = CATEGORIES.index(category)
+    return categories
+
+
+def collect(pairs, **options):
+    """
+    Run every pair and flatten the dataset into aligned arrays. Returns
+    (columns, timings) where columns holds the pair, category, truth and
+    prediction arrays with one entry per truth line, grouped by pair.
+    options are passed to time_pair.
+    """
+    columns = {
+        "pair": array("q"),
+        "category": array("b"),
+        "truth": array("q"),
+        "predicted": array("q")
+    }
+    timings = []
+
+    for pair_index, pair in enumerate(pairs):
+        old_records, new_records, mapping, pair_timings = time_pair(pair, **options)
+        timings.append(pair_timings)
+
+        truth = pair["truth"]
+        size = max(list(truth) + list(mapping) + [0]) + 1
+        predicted = mapping_array(mapping, size)
+        categories = categorize_truth(truth, old_records, new_records)
+
+        for old_line in sorted(truth):
+            columns["pair"].append(pair_index)
+            columns["category"].append(categories[old_line])
+            columns["truth"].append(truth[old_line])
+            columns["predicted"].append(predicted[old_line])
+
+    return columns, timings
+
+
+def _select(values, mask):
+    """Keep the entries of values where mask is true, as an array of the same type."""
+    return array(values.typecode, compress(values, mask))
+
+
+def _tally_numpy(category, truth, predicted):
+    """tally() with every count taken from one vectorized pass over the arrays."""
+    category = np.frombuffer(category, dtype=np.int8)
+    truth = np.frombuffer(truth, dtype=np.int64)
+    predicted = np.frombuffer(predicted, dtype=np.int64)
+
+    hits = truth == predicted
+    counts = {"correct": int(hits.sum()), "total": len(truth)}
+
+    totals = np.bincount(category, minlength=len(CATEGORIES))
+    corrects = np.bincount(category[hits], minlength=len(CATEGORIES))
+    for index, name in enumerate(CATEGORIES):
+        counts[name + "_correct"] = int(corrects[index])
+        counts[name + "_total"] = int(totals[index])
+
+    # Errors by kind, checked in the order missing, missed_delete, false_delete, wrong.
+    misses = ~hits
+    missing = misses & (predicted == MISSING)
+    missed_delete = misses & ~missing & (truth == -1)
+    false_delete = misses & (predicted == -1)
+    counts["wrong"] = int((misses & ~missing & ~missed_delete & ~false_delete).sum())
+    counts["false_delete"] = int(false_delete.sum())
+    counts["missed_delete"] = int(missed_delete.sum())
+    counts["missing"] = int(missing.sum())
+    return counts
+
+
+def tally(category, truth, predicted):
+    """Count correct/total overall and per category, plus error kinds, for aligned arrays."""
+    if np is not None:
+        return _tally_numpy(category, truth, predicted)
+
+    correct, total = score_arrays(truth, predicted)
+    counts = {"correct": correct, "total": total}
+
+    for index, name in enumerate(CATEGORIES):
+        mask = array("b", map(operator.eq, category, repeat(index)))
+        counts[name + "_correct"], counts[name + "_total"] = score_arrays(
+            _select(truth, mask), _select(predicted, mask)
+        )
+
+    # Errors by kind, checked in the order missing, missed_delete, false_delete, wrong.
+    deleted = _select(predicted, map(operator.eq, truth, repeat(-1)))
+    missing = predicted.count(MISSING)
+    missed_delete = len(deleted) - deleted.count(-1) - deleted.count(MISSING)
+    false_delete = predicted.count(-1) - deleted.count(-1)
+    counts["wrong"] = total - correct - missing - missed_delete - false_delete
+    counts["false_delete"] = false_delete
+    counts["missed_delete"] = missed_delete
+    counts["missing"] = missing
+    return counts
+
+
+def score_columns(columns, pair_count):
+    """Tally each pair's slice of the columns and the columns as a whole."""
+    per_pair = []
+    for pair_index in range(pair_count):
+        start = bisect_left(columns["pair"], pair_index)
+        stop = bisect_left(columns["pair"], pair_index + 1)
+        per_pair.append(tally(
+            columns["category"][start:stop], columns["truth"][start:stop], columns["predicted"][start:stop]
+        ))
+
+    overall = tally(columns["category"], columns["truth"], columns["predicted"])
+    return per_pair, overall
+
+
+def build_report(pairs, skip_comments=False, anchored=False):
+    """Run, score and time the dataset. Returns {"pairs": [...], "summary": {...}}."""
+    columns, timings = collect(pairs, skip_comments=skip_comments, anchored=anchored)
+    per_pair, overall = score_columns(columns, len(pairs))
+
+    rows = []
+    for pair, counts, pair_timings in zip(pairs, per_pair, timings):
+        row = {"name": pair["name"]}
+        row.update(counts)
+        row["accuracy"] = accuracy_percent(counts["correct"], counts["total"])
+        for stage, seconds in pair_timings.items():
+            row[stage] = seconds
+        rows.append(row)
+
+    summary = dict(overall)
+    summary["pairs"] = len(pairs)
+    summary["skip_comments"] = skip_comments
+    summary["anchored"] = anchored
+    summary["accuracy"] = accuracy_percent(overall["correct"], overall["total"])
+    for category in CATEGORIES:
+        summary[category + "_accuracy"] = accuracy_percent(
+            overall[category + "_correct"], overall[category + "_total"]
+        )
+    for stage in STAGES + ("total_s",):
+        summary[stage] = sum(pair_timings[stage] for pair_timings in timings)
+
+    return {"pairs": rows, "summary": summary}
+
+
+def write_csv(rows, out_path):
+    """Write one row per pair with counts, accuracy and stage timings."""
+    with open(out_path, "w", encoding="utf8", newline="") as handle:
+        writer = csv.DictWriter(handle, fieldnames=list(rows[0].keys()) if rows else ["name"])
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+
+
+def print_summary(report, slowest=5):
+    """Print overall accuracy, the per-category breakdown and the slowest pairs."""
+    summary = report["summary"]
+    print(
+        "OVERALL: " + str(summary["correct"]) + "/" + str(summary["total"])
+        + " (" + format(summary["accuracy"], ".2f") + "%)"
+        + "  time " + format(summary["total_s"], ".3f") + "s"
+    )
+
+    print("\ncategory     correct/total  accuracy")
+    for category in CATEGORIES:
+        print(
+            category.ljust(10),
+            (str(summary[category + "_correct"]) + "/" + str(summary[category + "_total"])).rjust(15),
+            (format(summary[category + "_accuracy"], ".2f") + "%").rjust(9)
+        )
+
+    print("\nerrors: " + ", ".join(kind + "=" + str(summary[kind]) for kind in ERROR_KINDS))
+    print("stages: " + ", ".join(stage + "=" + format(summary[stage], ".3f") for stage in STAGES))
+
+    print("\nslowest pairs        total_s   match_s  accuracy")
+    for row in sorted(report["pairs"], key=lambda row: row["total_s"], reverse=True)[:slowest]:
+        print(
+            row["name"][:18].ljust(18),
+            format(row["total_s"], ".3f").rjust(9),
+            format(row["match_s"], ".3f").rjust(9),
+            (format(row["accuracy"], ".2f") + "%").rjust(9)
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-pair accuracy by change type with stage timings.")
+    parser.add_argument("--dataset", choices=["provided", "my_dataset"], required=True)
+    parser.add_argument("--skip-comments", action="store_true",
+                        help="leave Java comment-only lines out of the mapping like blank lines")
+    parser.add_argument("--anchored", action="store_true",
+                        help="search Step 3 candidates between neighbouring unchanged lines before the whole file")
+    parser.add_argument("--json", help="write the full report (pairs and summary) as JSON to this path")
+    parser.add_argument("--csv", help="write one row per pair as CSV to this path")
+    args = parser.parse_args()
+
+    if args.dataset == "provided":
+        pairs = load_provided_pairs()
+    else:
+        pairs = load_my_dataset_pairs()
+
+    print("Pairs:", len(pairs))
+    report = build_report(pairs, skip_comments=args.skip_comments, anchored=args.anchored)
+    print_summary(report)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf8") as handle:
+            json.dump(report, handle, indent=2)
+        print("\nSaved:", args.json)
+    if args.csv:
+        write_csv(report["pairs"], args.csv)
+        print("Saved:", args.csv)
+
+
+if __name__ == "__main__":
+    main()
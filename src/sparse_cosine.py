@@ -0,0 +1,136 @@
+"""
+Batched token cosine for Step 4.
+
+utils.cosine_similarity tokenizes and counts both strings on every call, so
+Step 4 rebuilt the same counters once per candidate pair. Here each unmatched
+line is tokenized once into a row of a sparse token-count matrix in CSR form
+(indptr, indices, data), and the cosines of all candidate pairs come from one
+sparse dot product per pair. With NumPy installed the dot products are
+computed for every pair at once; otherwise a pure-Python loop walks the CSR
+rows. Dot products are exact integers and magnitudes use the same math.sqrt
+as cosine_similarity, so every value matches it bit for bit.
+"""
+import math
+from array import array
+from collections import Counter
+
+from utils import tokenize
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def build_token_matrix(texts, vocab):
+    """
+    Count the tokens of each text into a CSR matrix. vocab ({token: column})
+    is extended in place so old and new matrices share columns. Returns a dict
+    with indptr, indices, data and the per-row magnitudes in norms.
+    """
+    indptr = array("q", [0])
+    indices = array("q")
+    data = array("q")
+    norms = []
+
+    for text in texts:
+        counts = Counter(tokenize(text))
+        columns = []
+        for token, count in counts.items():
+            if token not in vocab:
+                vocab[token] = len(vocab)
+            columns.append((vocab[token], count))
+        columns.sort()
+        for column, count in columns:
+            indices.append(column)
+            data.append(count)
+        indptr.append(len(indices))
+        norms.append(math.sqrt(sum(count * count for count in counts.values())))
+
+    return {"indptr": indptr, "indices": indices, "data": data, "norms": norms}
+
+
+def _row(matrix, row):
+    """Return the (indices, data) slices of one CSR row."""
+    start = matrix["indptr"][row]
+    stop = matrix["indptr"][row + 1]
+    return matrix["indices"][start:stop], matrix["data"][start:stop]
+
+
+def _pair_dots_python(old_matrix, new_matrix, old_rows, new_rows):
+    """Sparse dot products row by row; the old row's lookup is reused across its candidates."""
+    dots = []
+    current = None
+    lookup = {}
+    for old_row, new_row in zip(old_rows, new_rows):
+        if old_row != current:
+            indices, data = _row(old_matrix, old_row)
+            lookup = dict(zip(indices, data))
+            current = old_row
+        indices, data = _row(new_matrix, new_row)
+        dot = 0
+        for column, count in zip(indices, data):
+            if column in lookup:
+                dot += lookup[column] * count
+        dots.append(dot)
+    return dots
+
+
+def _pair_dots_numpy(old_matrix, new_matrix, old_rows, new_rows, columns):
+    """
+    Sparse dot products for all pairs at once. Every nonzero of each pair's
+    new row is looked up in the old matrix by its (row, column) key with one
+    searchsorted over the old matrix's sorted keys.
+    """
+    old_indptr = np.array(old_matrix["indptr"], dtype=np.int64)
+    old_keys = np.repeat(np.arange(len(old_indptr) - 1, dtype=np.int64), np.diff(old_indptr)) * columns
+    old_keys += np.array(old_matrix["indices"], dtype=np.int64)
+    old_data = np.array(old_matrix["data"], dtype=np.int64)
+
+    new_indptr = np.array(new_matrix["indptr"], dtype=np.int64)
+    new_indices = np.array(new_matrix["indices"], dtype=np.int64)
+    new_data = np.array(new_matrix["data"], dtype=np.int64)
+
+    old_rows = np.asarray(old_rows, dtype=np.int64)
+    new_rows = np.asarray(new_rows, dtype=np.int64)
+    starts = new_indptr[new_rows]
+    lengths = new_indptr[new_rows + 1] - starts
+
+    # Flatten the nonzeros of every pair's new row into one run per pair.
+    pair_ids = np.repeat(np.arange(len(new_rows), dtype=np.int64), lengths)
+    run_offsets = np.cumsum(lengths) - lengths
+    positions = np.repeat(starts - run_offsets, lengths) + np.arange(int(lengths.sum()), dtype=np.int64)
+
+    keys = old_rows[pair_ids] * columns + new_indices[positions]
+    products = np.zeros(len(keys), dtype=np.int64)
+    if len(old_keys):
+        found = np.minimum(np.searchsorted(old_keys, keys), len(old_keys) - 1)
+        hits = old_keys[found] == keys
+        products[hits] = old_data[found[hits]] * new_data[positions[hits]]
+
+    dots = np.zeros(len(new_rows), dtype=np.int64)
+    np.add.at(dots, pair_ids, products)
+    return dots.tolist()
+
+
+def pair_cosines(old_matrix, new_matrix, old_rows, new_rows, columns):
+    """
+    Cosine similarity of old row old_rows[i] and new row new_rows[i] for every
+    i. columns is the shared vocabulary size.
+    """
+    if np is not None and old_rows:
+        dots = _pair_dots_numpy(old_matrix, new_matrix, old_rows, new_rows, columns)
+    else:
+        dots = _pair_dots_python(old_matrix, new_matrix, old_rows, new_rows)
+
+    old_norms = old_matrix["norms"]
+    new_norms = new_matrix["norms"]
+    cosines = []
+    for dot, old_row, new_row in zip(dots, old_rows, new_rows):
+        magnitude_a = old_norms[old_row]
+        magnitude_b = new_norms[new_row]
+        if magnitude_a == 0.0 or magnitude_b == 0.0:
+            cosines.append(0.0)
+        else:
+            cosines.append(dot / (magnitude_a * magnitude_b))
+    return cosines
@@ -0,0 +1,50 @@
+"""Disk spilling of scored pairs so Step 4 can run under a memory budget."""
+import heapq
+import struct
+
+# score, sequence number, old line, new line
+_PAIR_STRUCT = struct.Struct("<dqqq")
+
+# Rough in-memory cost of one buffered (score, seq, old_ln, new_ln) tuple.
+PAIR_BYTES = 160
+
+
+def write_run(handle, pairs):
+    """
+    Append one sorted run of (score, seq, old_ln, new_ln) tuples to the spill
+    file and return its (offset, count) so it can be read back later.
+    """
+    handle.seek(0, 2)
+    offset = handle.tell()
+    for pair in pairs:
+        handle.write(_PAIR_STRUCT.pack(*pair))
+    return offset, len(pairs)
+
+
+def iter_run(handle, offset, count, block_records):
+    """Stream a run back from the spill file a block at a time."""
+    position = offset
+    remaining = count
+    while remaining > 0:
+        take = min(block_records, remaining)
+        handle.seek(position)
+        data = handle.read(take * _PAIR_STRUCT.size)
+        position += len(data)
+        remaining -= take
+        for pair in _PAIR_STRUCT.iter_unpack(data):
+            yield pair
+
+
+def merge_runs(handle, runs, memory_budget):
+    """
+    Merge all spilled runs into one stream ordered by score (highest first),
+    with ties kept in the order the pairs were scored. The read buffers share
+    half of the memory budget between them.
+    """
+    if not runs:
+        return iter(())
+    block_bytes = max(_PAIR_STRUCT.size, (memory_budget // 2) // len(runs))
+    block_records = max(1, block_bytes // _PAIR_STRUCT.size)
+    streams = [iter_run(handle, offset, count, block_records) for offset, count in runs]
+    return heapq.merge(*streams, key=lambda pair: (-pair[0], pair[1]))
+
@@ -0,0 +1,302 @@
+"""
+Staged batch execution: discover -> read/preprocess -> match -> write.
+
+Each stage runs in its own threads and hands work to the next through a
+bounded queue, so a slow stage pushes back on the ones before it instead of
+letting work pile up in memory. Matching can run in worker processes while
+the I/O stages stay on threads, so disk reads and XML writes overlap with
+Steps 2-5.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+_DONE = object()
+
+
+class StageStats:
+    """Counters for one stage; shared by its threads behind a lock."""
+
+    def __init__(self, name, threads):
+        self.name = name
+        self.threads = threads
+        self.items = 0
+        self.busy = 0.0
+        self.wait_in = 0.0
+        self.wait_out = 0.0
+        self.started = None
+        self.finished = None
+        self.lock = threading.Lock()
+
+    def add(self, busy=0.0, wait_in=0.0, wait_out=0.0, items=0):
+        with self.lock:
+            now = time.perf_counter()
+            if self.started is None:
+                # The stage became active when it picked up its first item.
+                self.started = now - busy - wait_out
+            self.finished = now
+            self.items += items
+            self.busy += busy
+            self.wait_in += wait_in
+            self.wait_out += wait_out
+
+    def summary(self):
+        wall = 0.0
+        if self.started is not None:
+            wall = self.finished - self.started
+        throughput = self.items / wall if wall > 0 else 0.0
+        utilization = self.busy / (wall * self.threads) if wall > 0 else 0.0
+        return {
+            "stage": self.name,
+            "threads": self.threads,
+            "items": self.items,
+            "busy_s": self.busy,
+            "wait_in_s": self.wait_in,
+            "wait_out_s": self.wait_out,
+            "wall_s": wall,
+            "items_per_s": throughput,
+            "utilization": utilization
+        }
+
+
+class BoundedQueue:
+    """queue.Queue wrapper that samples its occupancy on every put and get."""
+
+    def __init__(self, name, maxsize):
+        self.name = name
+        self.maxsize = maxsize
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.samples = 0
+        self.total = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    def _sample(self):
+        size = self.queue.qsize()
+        with self.lock:
+            self.samples += 1
+            self.total += size
+            if size > self.peak:
+                self.peak = size
+
+    def put(self, item):
+        """Block until there is room; return the seconds spent waiting."""
+        started = time.perf_counter()
+        self.queue.put(item)
+        waited = time.perf_counter() - started
+        self._sample()
+        return waited
+
+    def get(self):
+        """Block until an item arrives; return (item, seconds spent waiting)."""
+        started = time.perf_counter()
+        item = self.queue.get()
+        waited = time.perf_counter() - started
+        self._sample()
+        return item, waited
+
+    def summary(self):
+        mean = self.total / self.samples if self.samples else 0.0
+        return {
+            "queue": self.name,
+            "capacity": self.maxsize,
+            "mean_occupancy": mean,
+            "peak_occupancy": self.peak
+        }
+
+
+def _timed_call(func, args, kwargs):
+    """Run func in a worker and report how long the call itself took."""
+    started = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+
+def run_staged(discover, load, match, write, match_kwargs=None, read_threads=2,
+               write_threads=1, workers=2, queue_size=8):
+    """
+    Run every pair from discover() through load(pair) -> (old_records,
+    new_records), match(old_records, new_records, **match_kwargs) and
+    write(pair, result). With workers > 0 matching runs in that many
+    processes (match must be a top-level function); with 0 it runs in the
+    dispatcher thread. Returns a report with per-stage and per-queue stats
+    plus any (pair name, error) failures. Raises ValueError unless every
+    stage has a thread and every queue a capacity of at least 1.
+    """
+    if read_threads < 1 or write_threads < 1:
+        raise ValueError("read_threads and write_threads must be at least 1")
+    if queue_size < 1:
+        raise ValueError("queue_size must be at least 1")
+    if workers < 0:
+        raise ValueError("workers must not be negative")
+    if match_kwargs is None:
+        match_kwargs = {}
+
+    read_queue = BoundedQueue("discover->read", queue_size)
+    match_queue = BoundedQueue("read->match", queue_size)
+    write_queue = BoundedQueue("match->write", queue_size)
+
+    stats = {
+        "discover": StageStats("discover", 1),
+        "read": StageStats("read", read_threads),
+        "match": StageStats("match", max(1, workers)),
+        "write": StageStats("write", write_threads)
+    }
+    errors = []
+    errors_lock = threading.Lock()
+
+    def fail(name, error):
+        with errors_lock:
+            errors.append((name, error))
+
+    def discover_stage():
+        started = time.perf_counter()
+        try:
+            for pair in discover():
+                busy = time.perf_counter() - started
+                waited = read_queue.put(pair)
+                stats["discover"].add(busy=busy, wait_out=waited, items=1)
+                started = time.perf_counter()
+        except Exception as error:
+            fail("discover", error)
+        finally:
+            for _ in range(read_threads):
+                read_queue.put(_DONE)
+
+    def read_stage():
+        while True:
+            pair, waited_in = read_queue.get()
+            if pair is _DONE:
+                match_queue.put(_DONE)
+                return
+            started = time.perf_counter()
+            try:
+                old_records, new_records = load(pair)
+            except Exception as error:
+                fail(pair["name"], error)
+                stats["read"].add(busy=time.perf_counter() - started, wait_in=waited_in)
+                continue
+            busy = time.perf_counter() - started
+            waited_out = match_queue.put((pair, old_records, new_records))
+            stats["read"].add(busy=busy, wait_in=waited_in, wait_out=waited_out, items=1)
+
+    def finish(future, pair):
+        try:
+            result, seconds = future.result()
+        except Exception as error:
+            fail(pair["name"], error)
+            return
+        waited_out = write_queue.put((pair, result))
+        stats["match"].add(busy=seconds, wait_out=waited_out, items=1)
+
+    def match_stage(executor):
+        pending = {}
+        readers_left = read_threads
+        while readers_left > 0:
+            item, waited_in = match_queue.get()
+            stats["match"].add(wait_in=waited_in)
+            if item is _DONE:
+                readers_left -= 1
+                continue
+            pair, old_records, new_records = item
+
+            if executor is None:
+                started = time.perf_counter()
+                try:
+                    result = match(old_records, new_records, **match_kwargs)
+                except Exception as error:
+                    fail(pair["name"], error)
+                    continue
+                busy = time.perf_counter() - started
+                waited_out = write_queue.put((pair, result))
+                stats["match"].add(busy=busy, wait_out=waited_out, items=1)
+                continue
+
+            # Keep at most one task per worker in flight so read backs up into its queue.
+            while len(pending) >= workers:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    finish(future, pending.pop(future))
+            try:
+                future = executor.submit(_timed_call, match, (old_records, new_records), match_kwargs)
+            except Exception as error:
+                fail(pair["name"], error)
+                continue
+            pending[future] = pair
+
+        for future in list(pending):
+            finish(future, pending.pop(future))
+        for _ in range(write_threads):
+            write_queue.put(_DONE)
+
+    def write_stage():
+        while True:
+            item, waited_in = write_queue.get()
+            if item is _DONE:
+                return
+            pair, result = item
+            started = time.perf_counter()
+            try:
+                write(pair, result)
+            except Exception as error:
+                fail(pair["name"], error)
+                continue
+            stats["write"].add(busy=time.perf_counter() - started, wait_in=waited_in, items=1)
+
+    started = time.perf_counter()
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 0 else None
+    try:
+        threads = [threading.Thread(target=discover_stage, name="discover")]
+        for index in range(read_threads):
+            threads.append(threading.Thread(target=read_stage, name="read-" + str(index)))
+        threads.append(threading.Thread(target=match_stage, args=(executor,), name="match"))
+        for index in range(write_threads):
+            threads.append(threading.Thread(target=write_stage, name="write-" + str(index)))
+
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    return {
+        "wall_s": time.perf_counter() - started,
+        "stages": [stats[name].summary() for name in ("discover", "read", "match", "write")],
+        "queues": [q.summary() for q in (read_queue, match_queue, write_queue)],
+        "errors": errors
+    }
+
+
+def print_stage_report(report):
+    """Print per-stage throughput and queue occupancy for a staged run."""
+    print("\nStage        threads  items   items/s   busy_s  wait_in_s  wait_out_s  util")
+    for row in report["stages"]:
+        print(
+            row["stage"].ljust(12),
+            str(row["threads"]).rjust(7),
+            str(row["items"]).rjust(6),
+            format(row["items_per_s"], ".2f").rjust(9),
+            format(row["busy_s"], ".3f").rjust(8),
+            format(row["wait_in_s"], ".3f").rjust(10),
+            format(row["wait_out_s"], ".3f").rjust(11),
+            format(row["utilization"] * 100.0, ".0f").rjust(4) + "%"
+        )
+
+    print("\nQueue           capacity  mean  peak")
+    for row in report["queues"]:
+        print(
+            row["queue"].ljust(15),
+            str(row["capacity"]).rjust(8),
+            format(row["mean_occupancy"], ".1f").rjust(5),
+            str(row["peak_occupancy"]).rjust(5)
+        )
+
+    busiest = max(report["stages"], key=lambda row: row["utilization"])
+    print("\nBusiest stage:", busiest["stage"], "(" + format(busiest["utilization"] * 100.0, ".0f") + "% utilized)")
+    print("Wall time:", format(report["wall_s"], ".3f") + "s")
+
+    for name, error in report["errors"]:
+        print("Failed:", name, "-", error)
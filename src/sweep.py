@@ -0,0 +1,242 @@
+import argparse
+import csv
+import itertools
+import time
+
+from provided_loader import load_provided_pairs
+from my_dataset_loader import load_my_dataset_pairs
+from preprocess import preprocess_file_bulk
+from unchanged_detect import detect_unchanged
+from block_move_detect import detect_block_moves
+from candidate_match import get_candidate_sets, build_scorer, score_pairs, assign_greedy
+from split_detect import detect_splits
+from utils import merge_mappings
+from metrics import score_mapping, accuracy_percent
+
+
+def parse_grid_values(text, cast):
+    """Turn a comma separated CLI value such as "5,10,15" into a sorted list."""
+    values = []
+    for part in text.split(","):
+        part = part.strip()
+        if part:
+            values.append(cast(part))
+    return sorted(set(values))
+
+
+def score_by_rank(unmatched_old, unmatched_new, candidates, max_k, min_threshold):
+    """
+    Score every candidate pair once with the pipeline's Step 4 scorer and
+    remember how long each candidate rank took, so the Step 4 cost of a
+    smaller k is the sum of its first k ranks. Pairs are pruned against the
+    lowest threshold in the grid, which no configuration can go below.
+    """
+    started = time.perf_counter()
+    scorer = build_scorer(unmatched_old, unmatched_new)
+    # Tokenizing the pools is shared by every rank; spread it evenly.
+    setup_seconds = (time.perf_counter() - started) / max_k
+
+    scores = {}
+    rank_seconds = [0.0] * max_k
+
+    for rank in range(max_k):
+        started = time.perf_counter()
+        pairs = []
+        for old_ln, new_list in candidates.items():
+            if rank < len(new_list) and new_list[rank] in scorer["new_rows"]:
+                pairs.append((old_ln, new_list[rank]))
+        for score, old_ln, new_ln in score_pairs(scorer, pairs, threshold=min_threshold):
+            scores[(old_ln, new_ln)] = score
+        rank_seconds[rank] = time.perf_counter() - started + setup_seconds
+
+    return scores, rank_seconds
+
+
+def cached_scored_pairs(candidates, scores, k, threshold):
+    """Rebuild the Step 4 scored pair list for one (k, threshold) from cached scores."""
+    scored_pairs = []
+    for old_ln, new_list in candidates.items():
+        for new_ln in new_list[:k]:
+            score = scores.get((old_ln, new_ln))
+            # Missing pairs were pruned below every threshold in the grid.
+            if score is None:
+                continue
+            if score >= threshold:
+                scored_pairs.append((score, old_ln, new_ln))
+    return scored_pairs
+
+
+def sweep_pair(old_path, new_path, grid):
+    """
+    Run every configuration in the grid for one pair. Steps 1-2 and block
+    move detection run once, Step 3 runs once for the largest k (smaller k are
+    prefixes of that list), Step 4 scores each candidate pair once and only the
+    threshold filter and greedy assignment repeat. Returns {config: (merged_map, seconds)}.
+    """
+    started = time.perf_counter()
+    old_records = preprocess_file_bulk(old_path)
+    new_records = preprocess_file_bulk(new_path)
+    unchanged_map, unmatched_old, unmatched_new = detect_unchanged(old_records, new_records)
+    block_map, unmatched_old, unmatched_new = detect_block_moves(unmatched_old, unmatched_new, min_lines=3)
+    step12_seconds = time.perf_counter() - started
+
+    max_k = max(grid["k"])
+    started = time.perf_counter()
+    candidates = get_candidate_sets(unmatched_old, unmatched_new, k=max_k)
+    step3_seconds = time.perf_counter() - started
+
+    scores, rank_seconds = score_by_rank(unmatched_old, unmatched_new, candidates, max_k, min(grid["threshold"]))
+
+    results = {}
+
+    for k in grid["k"]:
+        step4_score_seconds = sum(rank_seconds[:k])
+
+        for threshold in grid["threshold"]:
+            started = time.perf_counter()
+            scored_pairs = cached_scored_pairs(candidates, scores, k, threshold)
+            match_map, match_scores = assign_greedy(scored_pairs, unmatched_old)
+            assign_seconds = time.perf_counter() - started
+
+            for threshold_gain, max_extra in itertools.product(grid["threshold_gain"], grid["max_extra"]):
+                started = time.perf_counter()
+                final_map, split_map = detect_splits(
+                    unmatched_old, unmatched_new, match_map,
+                    threshold_gain=threshold_gain, max_extra=max_extra
+                )
+                step5_seconds = time.perf_counter() - started
+
+                merged_map = merge_mappings(unchanged_map, block_map, final_map)
+
+                seconds = step12_seconds + step3_seconds + step4_score_seconds + assign_seconds + step5_seconds
+                results[(k, threshold, threshold_gain, max_extra)] = (merged_map, seconds)
+
+    return results
+
+
+def pareto_front(rows):
+    """Return the configs no other config beats on both accuracy and runtime."""
+    front = set()
+    for row in rows:
+        dominated = False
+        for other in rows:
+            if other is row:
+                continue
+            better_or_equal = other["accuracy"] >= row["accuracy"] and other["seconds"] <= row["seconds"]
+            strictly_better = other["accuracy"] > row["accuracy"] or other["seconds"] < row["seconds"]
+            if better_or_equal and strictly_better:
+                dominated = True
+                break
+        if not dominated:
+            front.add(row["config"])
+    return front
+
+
+def run_sweep(pairs, grid):
+    """Sweep the grid over all pairs and return one summary row per config."""
+    totals = {}
+
+    for pair in pairs:
+        print("Sweeping", pair["name"])
+        results = sweep_pair(pair["old_path"], pair["new_path"], grid)
+        for config, (merged_map, seconds) in results.items():
+            correct, total = score_mapping(merged_map, pair["truth"])
+            if config not in totals:
+                totals[config] = [0, 0, 0.0]
+            totals[config][0] += correct
+            totals[config][1] += total
+            totals[config][2] += seconds
+
+    rows = []
+    for config in sorted(totals.keys()):
+        correct, total, seconds = totals[config]
+        rows.append({
+            "config": config,
+            "k": config[0],
+            "threshold": config[1],
+            "threshold_gain": config[2],
+            "max_extra": config[3],
+            "correct": correct,
+            "total": total,
+            "accuracy": accuracy_percent(correct, total),
+            "seconds": seconds
+        })
+
+    front = pareto_front(rows)
+    for row in rows:
+        row["pareto"] = row["config"] in front
+
+    return rows
+
+
+def print_table(rows):
+    """Print the accuracy x runtime table, marking Pareto-optimal configs with *."""
+    header = ["k", "threshold", "gain", "max_extra", "correct/total", "accuracy", "runtime_s", ""]
+    print("  ".join(h.rjust(13) for h in header))
+    for row in rows:
+        cells = [
+            str(row["k"]),
+            str(row["threshold"]),
+            str(row["threshold_gain"]),
+            str(row["max_extra"]),
+            str(row["correct"]) + "/" + str(row["total"]),
+            format(row["accuracy"], ".2f") + "%",
+            format(row["seconds"], ".3f"),
+            "*" if row["pareto"] else ""
+        ]
+        print("  ".join(c.rjust(13) for c in cells))
+
+
+def save_csv(rows, out_path):
+    fields = ["k", "threshold", "threshold_gain", "max_extra", "correct", "total", "accuracy", "seconds", "pareto"]
+    with open(out_path, "w", newline="", encoding="utf8") as handle:
+        writer = csv.DictWriter(handle, fieldnames=fields, extrasaction="ignore")
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep Step 3-5 parameters and report accuracy x runtime.")
+    parser.add_argument("--dataset", choices=["provided", "my_dataset"], required=True)
+    parser.add_argument("--k", default="15", help="comma separated candidate counts, e.g. 5,10,15")
+    parser.add_argument("--threshold", default="0.5", help="comma separated Step 4 thresholds")
+    parser.add_argument("--threshold-gain", default="0.02", help="comma separated Step 5 gains")
+    parser.add_argument("--max-extra", default="4", help="comma separated Step 5 extra line limits")
+    parser.add_argument("--csv", help="optional path for a CSV copy of the table")
+    args = parser.parse_args()
+
+    try:
+        grid = {
+            "k": parse_grid_values(args.k, int),
+            "threshold": parse_grid_values(args.threshold, float),
+            "threshold_gain": parse_grid_values(args.threshold_gain, float),
+            "max_extra": parse_grid_values(args.max_extra, int)
+        }
+    except ValueError as error:
+        parser.error(str(error))
+    for name, values in grid.items():
+        if not values:
+            parser.error("--" + name.replace("_", "-") + " needs at least one value")
+    if grid["k"][0] < 1:
+        parser.error("--k values must be at least 1")
+
+    if args.dataset == "provided":
+        pairs = load_provided_pairs()
+    else:
+        pairs = load_my_dataset_pairs()
+
+    print("Pairs:", len(pairs))
+
+    rows = run_sweep(pairs, grid)
+
+    print()
+    print_table(rows)
+
+    if args.csv:
+        save_csv(rows, args.csv)
+        print("Saved:", args.csv)
+
+
+if __name__ == "__main__":
+    main()
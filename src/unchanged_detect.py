@@ -14,11 +14,17 @@ def detect_unchanged(old_records, new_records):
     old_work = filter_records(old_records, keep_skip=False)
     new_work = filter_records(new_records, keep_skip=False)
 
-    old_norms = get_norm_list(old_work)
-    new_norms = get_norm_list(new_work)
+    return unchanged_from_keys(old_work, new_work, get_norm_list(old_work), get_norm_list(new_work))
 
+
+def unchanged_from_keys(old_work, new_work, old_keys, new_keys):
+    """
+    Step 2 on already filtered records, comparing old_keys[i] with new_keys[j]
+    instead of the text. Keys that are equal exactly when the normalized lines
+    are (such as interned ids) give the same result as detect_unchanged.
+    """
     # difflib respects relative order, giving us exact matches quickly.
-    matcher = difflib.SequenceMatcher(None, old_norms, new_norms)
+    matcher = difflib.SequenceMatcher(None, old_keys, new_keys)
 
     unchanged_map = {}
 
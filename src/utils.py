@@ -5,8 +5,27 @@ import math
 from collections import Counter
 import xml.etree.ElementTree as ET
 import os
+import mmap
+from functools import lru_cache
 
 _ws_re = re.compile(r"\s+")
+_space_run_re = re.compile(r"  +")
+_line_edge_ws_re = re.compile(r"^[^\S\n]+|[^\S\n]+$", re.MULTILINE)
+
+# Every character str.isspace() accepts apart from the newline itself.
+_INLINE_WS = (
+    "\t\x0b\x0c\r\x1c\x1d\x1e\x1f \x85\xa0\u1680\u2000\u2001\u2002\u2003"
+    "\u2004\u2005\u2006\u2007\u2008\u2009\u200a\u2028\u2029\u202f\u205f\u3000"
+)
+_to_space_table = str.maketrans(_INLINE_WS, " " * len(_INLINE_WS))
+_drop_ws_table = str.maketrans("", "", _INLINE_WS)
+
+# Strings are matched so comment markers inside literals are left alone.
+_java_comment_re = re.compile(
+    r'"""[\s\S]*?"""|"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'|//[^\n]*|/\*[\s\S]*?(?:\*/|\Z)'
+)
+
+MMAP_THRESHOLD = 1 << 20
 
 
 def read_file_lines(path):
@@ -18,6 +37,69 @@ def read_file_lines(path):
         return [line.rstrip("\n") for line in handle]
 
 
+def read_file_text(path):
+    """
+    Return the whole file as one string with newlines translated to "\\n".
+    Files of MMAP_THRESHOLD bytes or more are memory-mapped and decoded in place.
+    """
+    with open(path, "rb") as handle:
+        size = os.fstat(handle.fileno()).st_size
+        if size == 0:
+            return ""
+        if size >= MMAP_THRESHOLD:
+            with mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                with memoryview(mapped) as view:
+                    text = str(view, "utf8", "ignore")
+        else:
+            text = str(handle.read(), "utf8", "ignore")
+
+    # Match the universal newline handling of text-mode reads.
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return text
+
+
+def split_text_lines(text):
+    """Split a buffer into lines the same way iterating a text file would."""
+    lines = text.split("\n")
+    if lines[-1] == "":
+        lines.pop()
+    return lines
+
+
+def normalize_text(text, lowercase=True, collapse_ws=True):
+    """
+    Whole-buffer version of per-line normalization: strip each line, collapse
+    inner whitespace runs and lowercase, without splitting the buffer first.
+    """
+    if collapse_ws:
+        # After collapsing, each line edge holds at most one space.
+        text = _space_run_re.sub(" ", text.translate(_to_space_table))
+        text = text.replace("\n ", "\n").replace(" \n", "\n").strip(" ")
+    else:
+        text = _line_edge_ws_re.sub("", text)
+
+    if lowercase:
+        text = text.lower()
+
+    return text
+
+
+def java_code_text(text):
+    """
+    Return the buffer with Java comments removed and inline whitespace dropped,
+    keeping one line per source line, so comment-only lines come out empty.
+    """
+    def keep_code(match):
+        token = match.group()
+        if token[0] in "\"'":
+            return token
+        return "\n" * token.count("\n")
+
+    code = _java_comment_re.sub(keep_code, text)
+    return code.translate(_drop_ws_table)
+
+
 def collapse_whitespace(value):
     """Collapse any whitespace run into a single space and trim the ends."""
     return _ws_re.sub(" ", value).strip()
@@ -51,10 +133,12 @@ def tokenize(text):
     """Return lowercase word tokens for use in similarity measurements."""
     return _word_re.findall(text.lower())
 
+@lru_cache(maxsize=1 << 16)
 def simhash(text):
     """
     Build a 64-bit SimHash fingerprint from the normalized text tokens.
     Each bit stores whether ones or zeros were more common in that position.
+    Results are cached because common lines recur across pairs in a batch.
     """
     tokens = tokenize(text)
     if not tokens:
@@ -115,6 +199,17 @@ def levenshtein_similarity(a, b):
     return 1.0 - (distance / max_len)
 
 
+def levenshtein_upper_bound(a, b):
+    """
+    Cheap upper bound on levenshtein_similarity: the edit distance is at
+    least the length difference.
+    """
+    max_len = max(len(a), len(b))
+    if max_len == 0:
+        return 1.0
+    return 1.0 - (abs(len(a) - len(b)) / max_len)
+
+
 def cosine_similarity(a, b):
     """Return cosine similarity of token frequency vectors for two strings."""
     tokens_a = tokenize(a)
@@ -141,12 +236,35 @@ def combined_similarity(a, b):
     return 0.6 * levenshtein_similarity(a, b) + 0.4 * cosine_similarity(a, b)
 
 
+def merge_mappings(*maps):
+    """Merge old->new mappings in order; later maps override earlier ones."""
+    merged_map = {}
+    for mapping in maps:
+        for old_line, new_line in mapping.items():
+            merged_map[old_line] = new_line
+    return merged_map
+
+
 def join_norm_lines(parts):
     """Concatenate normalized line fragments into one string for split scoring."""
     return " ".join(parts).strip()
 
 
 
+def parse_size(value):
+    """Parse a byte count such as "512K", "64M" or "2G" (plain numbers are bytes)."""
+    text = str(value).strip().upper()
+    if text.endswith("B"):
+        text = text[:-1]
+    factor = 1
+    for suffix, multiplier in (("K", 1 << 10), ("M", 1 << 20), ("G", 1 << 30)):
+        if text.endswith(suffix):
+            text = text[:-1]
+            factor = multiplier
+            break
+    return int(float(text) * factor)
+
+
 def parse_truth_xml(xml_path):
     """
     Load the truth mapping from the final VERSION block of a provided XML file.
@@ -166,13 +284,16 @@ def parse_truth_xml(xml_path):
         mapping[old_line] = new_line
     return mapping
 
-def save_prediction_xml(name, mapping, split_map, out_path):
+def save_prediction_xml(name, mapping, split_map, out_path, tier=None, cross_map=None):
     folder = os.path.dirname(out_path)
     if folder and not os.path.exists(folder):
         os.makedirs(folder)
 
     test = ET.Element("TEST")
     test.set("NAME", str(name))
+    if tier is not None:
+        # Quality tier picked by the deadline-aware pipeline (adaptive.py).
+        test.set("TIER", str(tier))
 
     version = ET.SubElement(test, "VERSION")
     version.set("NUMBER", "1")
@@ -182,6 +303,12 @@ def save_prediction_xml(name, mapping, split_map, out_path):
         loc = ET.SubElement(version, "LOCATION")
         loc.set("ORIG", str(old_ln))
         loc.set("NEW", str(mapping[old_ln]))
+        if cross_map and old_ln in cross_map:
+            # Line moved to another file of the change set (cross_file.py);
+            # NEW keeps the in-file -1 so ORIG/NEW readers are unaffected.
+            target_file, new_ln = cross_map[old_ln]
+            loc.set("CROSS_FILE", target_file)
+            loc.set("CROSS_NEW", str(new_ln))
 
     if split_map and len(split_map) > 0:
         splits = ET.SubElement(test, "SPLITS")